@@ -0,0 +1,217 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import llm
+import reasoning
+import report
+from extraction import ExtractionCache, IncompleteText
+from groq_client import ResilientGroq
+from llm import ResponseCache
+from models import resolve_model
+from retrieval import ChunkIndex, context_token_budget
+from router import ROUTING_PREFERENCES, ModelRouter
+
+# Headless batch runner: answers a JSONL file of jobs without the Streamlit UI.
+#
+# Each job is one JSON object per line:
+#   {"id": "optional", "query": "...", "file": "path/to/doc.pdf", "model": "Llama 3 70B" or a model id,
+#    "reasoning_type": "Single-path", "selected_task": "...", "system_prompt": "..."}
+# A job without a query generates a report on its file, like the Generate Report button.
+# Results are appended to the output JSONL as they finish; rerunning with the same output resumes
+# by skipping every job that already has a successful result.
+#
+#   python batch.py jobs.jsonl results.jsonl --concurrency 8 --parquet results.parquet
+
+CACHE_DIR = os.getenv("GSEARCH_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant that provides summaries and details based on user queries and given context."
+
+
+# Stable id for jobs that don't carry one, so resume works across runs
+def job_id(job):
+    if job.get("id") is not None:
+        return str(job["id"])
+    payload = json.dumps({key: job.get(key) for key in ("query", "file", "model", "reasoning_type", "selected_task", "system_prompt")}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def read_jobs(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Ids of jobs that already have a successful result in the output file
+def completed_job_ids(output_path):
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a partial last line
+                continue
+            if not result.get("error"):
+                done.add(result["id"])
+    return done
+
+
+# Extracted text and retrieval index of recently used input files, so the jobs sharing a file load it once.
+# At most max_entries documents are held; the least recently used goes first.
+class DocumentCache:
+    def __init__(self, extraction_cache, max_entries=8):
+        self.extraction_cache = extraction_cache
+        self.max_entries = max_entries
+        self._documents = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, path):
+        with self._lock:
+            if path in self._documents:
+                self._documents.move_to_end(path)
+                return self._documents[path]
+            return None
+
+    def get(self, path):
+        document = self._cached(path)
+        if document is not None:
+            return document
+        with self._lock:
+            lock = self._locks.setdefault(path, threading.Lock())
+        with lock:
+            # Another job may have loaded it while this one waited
+            document = self._cached(path)
+            if document is not None:
+                return document
+            with open(path, "rb") as f:
+                text = self.extraction_cache.get_or_extract(f.read(), os.path.basename(path))
+            document = (text, ChunkIndex(text))
+            with self._lock:
+                self._documents[path] = document
+                while len(self._documents) > self.max_entries:
+                    self._documents.popitem(last=False)
+                # Jobs arriving later find the document (or reload it after eviction), so the lock can go
+                self._locks.pop(path, None)
+            return document
+
+
+def run_job(client, documents, job, route=None):
+    model_id = resolve_model(job.get("model", "Mixtral 8x7B"))
+    reasoning_type = job.get("reasoning_type", "Single-path")
+    selected_task = job.get("selected_task") if reasoning_type == "Multi-path" else None
+    system_prompt = job.get("system_prompt", DEFAULT_SYSTEM_PROMPT)
+    query = job.get("query", "")
+    result = {"id": job_id(job), "query": query, "file": job.get("file"), "model": model_id, "reasoning_type": reasoning_type}
+    started = time.perf_counter()
+    try:
+        text, index = documents.get(job["file"]) if job.get("file") else ("", None)
+        if isinstance(text, IncompleteText):
+            result["skipped_pages"] = text.skipped_pages
+        timings = {}
+        if not query:
+            summary, details, stats = report.generate_report(client, text, os.path.basename(job["file"]), model_id, system_prompt, reasoning_type, selected_task,
+                                                             index=index, timings=timings, route=route)
+            result["stats"] = stats
+        else:
+            context = index.select(query, context_token_budget(model_id), text) if index else ""
+            summary, details = reasoning.run_query(client, query, model_id, system_prompt, context, reasoning_type, selected_task, timings=timings, route=route)
+        result.update(summary=summary, details=details, timings=timings or None, error=None)
+    except Exception as e:
+        result.update(summary=None, details=None, error=f"{type(e).__name__}: {e}")
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+# Run jobs with at most `concurrency` in flight, appending each result to output_path as it completes
+def run_batch(client, jobs, output_path, concurrency=8, documents=None, on_result=None, route=None):
+    documents = documents or DocumentCache(ExtractionCache(os.path.join(CACHE_DIR, "extraction")))
+    done = completed_job_ids(output_path)
+    pending_jobs = iter([job for job in jobs if job_id(job) not in done])
+    counts = {"skipped": len(done & {job_id(job) for job in jobs}), "ok": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool, open(output_path, "a", encoding="utf-8") as out:
+        in_flight = set()
+        while True:
+            # Keep the pool fed without queueing every job up front
+            for job in pending_jobs:
+                in_flight.add(pool.submit(run_job, client, documents, job, route))
+                if len(in_flight) >= concurrency * 2:
+                    break
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                counts["failed" if result["error"] else "ok"] += 1
+                if on_result:
+                    on_result(result, counts)
+    return counts
+
+
+# Latest result per job id, written to Parquet (needs pyarrow)
+def export_parquet(output_path, parquet_path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet export needs pyarrow: pip install pyarrow")
+    latest = {}
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            latest[result["id"]] = result
+    columns = list(dict.fromkeys(key for result in latest.values() for key in result))
+    rows = [{key: json.dumps(result.get(key)) if isinstance(result.get(key), dict) else result.get(key) for key in columns} for result in latest.values()]
+    pq.write_table(pa.Table.from_pylist(rows), parquet_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL batch of queries and reports without the Streamlit UI.")
+    parser.add_argument("jobs", help="input JSONL, one job per line")
+    parser.add_argument("output", help="output JSONL; existing successful results are kept and skipped")
+    parser.add_argument("--concurrency", type=int, default=8, help="jobs in flight at once (default 8)")
+    parser.add_argument("--parquet", help="also write the latest result per job to this Parquet file")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the response cache")
+    parser.add_argument("--routing", choices=ROUTING_PREFERENCES, default="Quality", help="per-stage model routing preference (default Quality)")
+    parser.add_argument("--speculative", action="store_true", help="race routed stages against the job's model")
+    parser.add_argument("--router-log", help="append every routing decision to this JSONL file")
+    args = parser.parse_args(argv)
+
+    groq_api_key = os.getenv("GROQ_API_KEY")
+    if not groq_api_key:
+        raise SystemExit("GROQ_API_KEY not found in environment variables.")
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if not args.no_cache:
+        llm.set_response_cache(ResponseCache(os.path.join(CACHE_DIR, "responses.sqlite3")))
+    client = ResilientGroq(api_key=groq_api_key, max_concurrency=max(16, args.concurrency))
+    router = ModelRouter(log_path=args.router_log)
+    llm.set_call_observer(router.observe)
+
+    jobs = read_jobs(args.jobs)
+    started = time.perf_counter()
+
+    def progress(result, counts):
+        status = "failed: " + result["error"] if result["error"] else f"ok in {result['seconds']}s"
+        print(f"[{counts['ok'] + counts['failed']}/{len(jobs) - counts['skipped']}] {result['id']} {status}", file=sys.stderr)
+
+    counts = run_batch(client, jobs, args.output, args.concurrency, on_result=progress, route=router.policy(args.routing, args.speculative))
+    print(f"{counts['ok']} ok, {counts['failed']} failed, {counts['skipped']} already done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    if args.parquet:
+        export_parquet(args.output, args.parquet)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import llm
+import reasoning
+from extraction import extract_text_from_file
+from groq_client import ResilientGroq
+from models import SUPPORTED_MODELS
+from retrieval import ChunkIndex, context_token_budget
+from tokens import count_tokens
+
+# Latency benchmarks that run without a Groq key: a local stub stands in for the completion API,
+# and synthetic PDF/DOCX/TXT documents stand in for uploads.
+#
+#   python bench.py --output bench.json
+#   python bench.py --output new.json --compare bench.json
+#
+# The stub is deterministic for a given --seed: reply text depends only on the request, and
+# injected errors (429 with Retry-After-Ms, or 500) follow a seeded sequence.
+
+DOCUMENT_SIZES = {"small": 2_000, "medium": 20_000, "large": 100_000}
+WORDS_PER_PAGE = 400
+DEFAULT_MODEL = "mixtral-8x7b-32768"
+BENCH_QUERIES = (
+    "What are the main findings about throughput?",
+    "Summarize the section on storage latency.",
+    "Which risks does the document list for the migration?",
+    "How is the cache invalidated after an update?",
+    "What does the report recommend for capacity planning?",
+)
+BENCH_SYSTEM_PROMPT = "You are a helpful assistant."
+
+_VOCABULARY = (
+    "latency throughput cache index request model token budget window retrieval summary report storage network "
+    "migration capacity planning replica shard queue worker process thread memory disk update invalidate "
+    "measure result finding risk recommend section document analysis baseline regression percentile median"
+).split()
+
+
+# Completion endpoint speaking the OpenAI/Groq chat API, with configurable time to first token,
+# token rate and error injection
+class StubCompletionServer:
+    def __init__(self, latency=0.05, tokens_per_second=500.0, reply_tokens=120, error_rate=0.0, seed=0,
+                 error_statuses=(429, 500), retry_after_headers=(("retry-after-ms", "20"),)):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.retry_after_headers = retry_after_headers
+        self.stats = {"requests": 0, "errors": 0, "streams": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _stub_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # None, or the HTTP status of an injected failure for the next request
+    def next_error(self):
+        with self._lock:
+            self.stats["requests"] += 1
+            if self._random.random() >= self.error_rate:
+                return None
+            self.stats["errors"] += 1
+            return self._random.choice(self.error_statuses)
+
+    def reply_words(self, body):
+        digest = hashlib.sha256(json.dumps(body["messages"], sort_keys=True).encode("utf-8")).digest()
+        rng = random.Random(digest)
+        count = min(self.reply_tokens, body.get("max_tokens") or self.reply_tokens)
+        words = [rng.choice(_VOCABULARY) for _ in range(max(1, count))]
+        # Summary line first, then details, like a real answer
+        return words[:12] + ["\n\n"] + words[12:]
+
+
+def _stub_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=()):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+            error = stub.next_error()
+            time.sleep(stub.latency)
+            if error == 429:
+                self._send_json(429, {"error": {"message": "stub rate limit", "type": "rate_limit_exceeded"}}, stub.retry_after_headers)
+                return
+            if error:
+                self._send_json(500, {"error": {"message": "stub failure", "type": "internal_server_error"}})
+                return
+            words = stub.reply_words(body)
+            prompt_tokens = sum(count_tokens(message.get("content") or "") for message in body["messages"])
+            if body.get("stream"):
+                with stub._lock:
+                    stub.stats["streams"] += 1
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for word in words:
+                        chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                                 "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        time.sleep(1.0 / stub.tokens_per_second)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the stream early (e.g. the losing side of a routing race)
+                    pass
+                return
+            time.sleep(len(words) / stub.tokens_per_second)
+            self._send_json(200, {
+                "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)},
+            })
+
+    return Handler
+
+
+# Deterministic filler text of about `words` words, in paragraphs
+def synthetic_text(words, seed=0):
+    rng = random.Random(seed)
+    paragraphs = []
+    while words > 0:
+        count = min(words, rng.randint(40, 120))
+        sentence = [rng.choice(_VOCABULARY) for _ in range(count)]
+        paragraphs.append(" ".join(sentence).capitalize() + ".")
+        words -= count
+    return "\n\n".join(paragraphs)
+
+
+# Minimal uncompressed PDF with one Helvetica text block per page
+def make_pdf(text, words_per_page=WORDS_PER_PAGE):
+    words = text.split()
+    pages = [words[i:i + words_per_page] for i in range(0, len(words), words_per_page)] or [[]]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        lines = [" ".join(page[i:i + 12]) for i in range(0, len(page), 12)]
+        stream = "BT /F1 10 Tf 12 TL 72 760 Td " + " T* ".join(f"({line}) Tj" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>"
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+
+def make_docx(text):
+    import docx
+
+    document = docx.Document()
+    for paragraph in text.split("\n\n"):
+        document.add_paragraph(paragraph)
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+# {size: {extension: file bytes}} for every entry of `sizes`
+def synthetic_corpus(sizes, seed=0):
+    corpus = {}
+    for name, words in sizes.items():
+        text = synthetic_text(words, seed)
+        corpus[name] = {"txt": text.encode("utf-8"), "pdf": make_pdf(text), "docx": make_docx(text)}
+    return corpus
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean": round(statistics.fmean(ordered), 6),
+        "median": round(statistics.median(ordered), 6),
+        "p95": round(ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))], 6),
+        "min": round(ordered[0], 6),
+        "max": round(ordered[-1], 6),
+    }
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def bench_extraction(corpus, repeats):
+    results = []
+    for size, files in corpus.items():
+        for extension, content in files.items():
+            file_name = f"bench-{size}.{extension}"
+            # The first call pays for worker start-up and imports; report it apart from the steady state
+            cold, text = timed(extract_text_from_file, content, file_name)
+            samples = [timed(extract_text_from_file, content, file_name)[0] for _ in range(repeats)]
+            results.append({"format": extension, "size": size, "bytes": len(content), "chars": len(text),
+                            "cold": round(cold, 6), "seconds": summarize(samples)})
+    return results
+
+
+# Message building (fitting text to the window, counting tokens, budgeting the reply) for one reasoning type.
+# Single-path and Multi-path get the query plus the selected context. Advance Steps and Enhanced System Prompt
+# are fed the selected context as their input, as when they report on a document; the later advanced stages,
+# whose input is the previous stage's reply, are fed reply-sized text.
+def build_messages(reasoning_type, query, context, model_id, replies):
+    if reasoning_type == "Advance Steps":
+        stage_inputs = [context] + [replies[max_tokens] for _, _, _, max_tokens in reasoning.ADVANCED_STEPS[:-1]]
+        return [reasoning.advanced_stage_messages(stage_input, model_id, system_prompt, template, max_tokens)
+                for stage_input, (_, system_prompt, template, max_tokens) in zip(stage_inputs, reasoning.ADVANCED_STEPS)]
+    if reasoning_type == "Enhanced System Prompt":
+        return reasoning.enhanced_messages(context, model_id)
+    selected_task = reasoning.TASK_TYPES[0] if reasoning_type == "Multi-path" else None
+    return reasoning.search_messages(query, model_id, BENCH_SYSTEM_PROMPT, context, reasoning_type, selected_task)
+
+
+# Retrieval index build, per-query context selection and message building per reasoning type:
+# the work done before the first model call
+def bench_prompt_assembly(texts, model_id, repeats):
+    results = []
+    budget = context_token_budget(model_id)
+    replies = {max_tokens: synthetic_text(max_tokens) for _, _, _, max_tokens in reasoning.ADVANCED_STEPS}
+    for size, text in texts.items():
+        build = []
+        for _ in range(repeats):
+            seconds, index = timed(ChunkIndex, text)
+            build.append(seconds)
+        select, context_tokens = [], []
+        messages = {reasoning_type: [] for reasoning_type in reasoning.REASONING_TYPES}
+        for _ in range(repeats):
+            for query in BENCH_QUERIES:
+                seconds, context = timed(index.select, query, budget, text)
+                select.append(seconds)
+                context_tokens.append(count_tokens(context))
+                for reasoning_type, samples in messages.items():
+                    samples.append(timed(build_messages, reasoning_type, query, context, model_id, replies)[0])
+        results.append({"size": size, "document_tokens": count_tokens(text), "context_tokens": max(context_tokens),
+                        "index_build": summarize(build), "select": summarize(select),
+                        "messages": {reasoning_type: summarize(samples) for reasoning_type, samples in messages.items()}})
+    return results
+
+
+def bench_end_to_end(client, text, index, model_id, repeats):
+    results = []
+    budget = context_token_budget(model_id)
+    for reasoning_type in reasoning.REASONING_TYPES:
+        selected_task = reasoning.TASK_TYPES[0] if reasoning_type == "Multi-path" else None
+        latency, first_token, failures = [], [], 0
+        for i in range(repeats):
+            query = BENCH_QUERIES[i % len(BENCH_QUERIES)] + f" (run {i})"
+            timings = {}
+            started = time.perf_counter()
+            try:
+                context = index.select(query, budget, text)
+                reasoning.run_query(client, query, model_id, BENCH_SYSTEM_PROMPT, context, reasoning_type, selected_task,
+                                    bypass_cache=True, timings=timings)
+            except Exception:
+                failures += 1
+                continue
+            latency.append(time.perf_counter() - started)
+            if timings:
+                first = min(timing["first_token"] for timing in timings.values() if timing["first_token"] is not None)
+                first_token.append(first)
+        entry = {"reasoning_type": reasoning_type, "failures": failures, "latency": summarize(latency) if latency else None}
+        if first_token:
+            entry["first_token"] = summarize(first_token)
+        results.append(entry)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(repeats=5, sizes=DOCUMENT_SIZES, model_id=DEFAULT_MODEL, latency=0.05, tokens_per_second=500.0,
+                   reply_tokens=120, error_rate=0.0, seed=0):
+    config = {"repeats": repeats, "sizes": dict(sizes), "model": model_id, "stub_latency": latency,
+              "stub_tokens_per_second": tokens_per_second, "stub_reply_tokens": reply_tokens, "stub_error_rate": error_rate, "seed": seed}
+    corpus = synthetic_corpus(sizes, seed)
+    texts = {size: files["txt"].decode("utf-8") for size, files in corpus.items()}
+    results = {
+        "meta": {"revision": git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+                 "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "config": config},
+        "extraction": bench_extraction(corpus, repeats),
+        "prompt_assembly": bench_prompt_assembly(texts, model_id, repeats),
+    }
+    # Only the stub's own latency should count, so lift the client's per-model rate limits and keep retries quick
+    previous_cache = llm.get_response_cache()
+    llm.set_response_cache(None)
+    try:
+        with StubCompletionServer(latency, tokens_per_second, reply_tokens, error_rate, seed) as stub:
+            unlimited = {model: (10 ** 6, 10 ** 9) for model in SUPPORTED_MODELS.values()}
+            client = ResilientGroq(api_key="stub", base_url=stub.base_url, rate_limits=unlimited, backoff_base=0.01, backoff_max=0.1)
+            medium = "medium" if "medium" in texts else next(iter(texts))
+            results["end_to_end"] = bench_end_to_end(client, texts[medium], ChunkIndex(texts[medium]), model_id, repeats)
+            results["stub"] = dict(stub.stats)
+            results["client"] = {name: round(value, 6) if isinstance(value, float) else value for name, value in client.stats.items()}
+    finally:
+        llm.set_response_cache(previous_cache)
+    return results
+
+
+# Median of every timed metric, keyed by a readable path, for comparing two result files
+def flatten_medians(results):
+    medians = {}
+    for entry in results.get("extraction", []):
+        medians[f"extraction/{entry['format']}/{entry['size']}"] = entry["seconds"]["median"]
+    for entry in results.get("prompt_assembly", []):
+        medians[f"prompt_assembly/index_build/{entry['size']}"] = entry["index_build"]["median"]
+        medians[f"prompt_assembly/select/{entry['size']}"] = entry["select"]["median"]
+        for reasoning_type, seconds in entry.get("messages", {}).items():
+            medians[f"prompt_assembly/messages/{reasoning_type}/{entry['size']}"] = seconds["median"]
+    for entry in results.get("end_to_end", []):
+        if entry["latency"]:
+            medians[f"end_to_end/{entry['reasoning_type']}"] = entry["latency"]["median"]
+        if entry.get("first_token"):
+            medians[f"end_to_end/{entry['reasoning_type']}/first_token"] = entry["first_token"]["median"]
+    return medians
+
+
+def compare(baseline, current):
+    before, after = flatten_medians(baseline), flatten_medians(current)
+    lines = []
+    for name in sorted(before.keys() & after.keys()):
+        change = (after[name] - before[name]) / before[name] * 100 if before[name] else 0.0
+        lines.append(f"{name:55s} {before[name] * 1000:10.2f}ms -> {after[name] * 1000:10.2f}ms  {change:+7.1f}%")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark extraction, prompt assembly and end-to-end latency against a stub model server.")
+    parser.add_argument("--output", help="write results as JSON to this file (default: stdout)")
+    parser.add_argument("--compare", help="print median changes against an earlier results file")
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per measurement (default 5)")
+    parser.add_argument("--sizes", default=",".join(DOCUMENT_SIZES), help=f"document sizes to generate, from {', '.join(DOCUMENT_SIZES)}")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="model id sent to the stub")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub seconds before the first token (default 0.05)")
+    parser.add_argument("--tokens-per-second", type=float, default=500.0, help="stub generation rate (default 500)")
+    parser.add_argument("--reply-tokens", type=int, default=120, help="stub reply length in tokens (default 120)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub requests failing with 429 or 500 (default 0)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    sizes = {name: DOCUMENT_SIZES[name] for name in args.sizes.split(",") if name}
+    results = run_benchmarks(args.repeats, sizes, args.model, args.latency, args.tokens_per_second, args.reply_tokens, args.error_rate, args.seed)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(json.load(f), results), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
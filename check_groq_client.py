@@ -0,0 +1,134 @@
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import groq
+
+from bench import StubCompletionServer
+from groq_client import AIMDLimiter, RequestCancelled, ResilientGroq, retry_after_seconds
+
+# Checks of ResilientGroq's overload handling against the local stub from bench.py, no Groq key needed:
+# Retry-After parsing, retries that honour it, fallback to backoff on a malformed header, one
+# AIMD decrease per burst of 429s, and requests cancelled while they queue.
+#
+#   python check_groq_client.py
+
+MODEL = "mixtral-8x7b-32768"
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+class _Headers:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class _Error:
+    def __init__(self, headers):
+        self.response = _Headers(headers)
+
+
+def check_retry_after_parsing(check):
+    check(retry_after_seconds(_Error({"retry-after-ms": "250"})) == 0.25, "retry-after-ms is read in milliseconds")
+    check(retry_after_seconds(_Error({"retry-after": "3"})) == 3.0, "retry-after is read in seconds")
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    check(25 <= retry_after_seconds(_Error({"retry-after": date})) <= 31, "retry-after accepts an HTTP date")
+    for value in ("soon", "Wed, 99 Foo 2015 07:28:00 GMT", "1 2 3"):
+        check(retry_after_seconds(_Error({"retry-after": value})) is None, f"malformed retry-after {value!r} is ignored")
+    check(retry_after_seconds(_Error({})) is None, "no header means no server delay")
+
+
+# Every request is rejected with 429; the client retries max_retries times, waiting at least Retry-After each time
+def check_retries(check, retry_after_headers, min_seconds):
+    with StubCompletionServer(error_rate=1.0, error_statuses=(429,), retry_after_headers=retry_after_headers) as stub:
+        client = ResilientGroq(api_key="stub", base_url=stub.base_url, max_retries=2, backoff_base=0.01, backoff_max=0.02)
+        started = time.monotonic()
+        try:
+            client.chat.completions.create(model=MODEL, messages=MESSAGES, max_tokens=16)
+            error = None
+        except Exception as e:
+            error = e
+        seconds = time.monotonic() - started
+    label = ", ".join(f"{name}: {value}" for name, value in retry_after_headers)
+    check(isinstance(error, groq.RateLimitError), f"[{label}] a request rejected every time ends in RateLimitError, got {error!r}")
+    check(stub.stats["requests"] == 3 and client.stats["retries"] == 2 and client.stats["rate_limited"] == 3,
+          f"[{label}] one request and two retries, got {stub.stats['requests']} requests and stats {client.stats}")
+    check(seconds >= min_seconds, f"[{label}] retries waited {seconds:.2f}s, expected at least {min_seconds}s")
+
+
+def check_aimd(check):
+    limiter = AIMDLimiter(initial=8, maximum=16)
+    sent = time.monotonic()
+    for _ in range(8):
+        limiter.acquire()
+    for _ in range(8):
+        limiter.release(overloaded=True, sent=sent)
+    check(limiter.limit == 4, f"a burst of 429s from requests sent together halves the limit once, got {limiter.limit}")
+    limiter.acquire()
+    limiter.release(overloaded=True, sent=time.monotonic())
+    check(limiter.limit == 2, f"a 429 on a request sent after the decrease halves it again, got {limiter.limit}")
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release()
+    check(2 < limiter.limit <= 4, f"successes grow the limit additively, got {limiter.limit}")
+
+    # The same through the client: concurrent requests all rejected at once cost one decrease
+    with StubCompletionServer(latency=0.2, error_rate=1.0, error_statuses=(429,), retry_after_headers=()) as stub:
+        client = ResilientGroq(api_key="stub", base_url=stub.base_url, max_retries=0, initial_concurrency=4)
+        barrier = threading.Barrier(4)
+
+        def request():
+            barrier.wait()
+            try:
+                client.chat.completions.create(model=MODEL, messages=MESSAGES, max_tokens=16)
+            except groq.RateLimitError:
+                pass
+
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    check(client.concurrency.limit == 2, f"four concurrent 429s halve the client's limit once, got {client.concurrency.limit}")
+
+
+# A request whose caller gave up while it queued is never sent, and hands back everything it acquired
+def check_cancelled(check):
+    with StubCompletionServer() as stub:
+        client = ResilientGroq(api_key="stub", base_url=stub.base_url)
+        request_bucket, token_bucket = client._model_buckets(MODEL)
+        try:
+            client.chat.completions.create(model=MODEL, messages=MESSAGES, max_tokens=16, stream=True, cancelled=lambda: True)
+            error = None
+        except Exception as e:
+            error = e
+        request_bucket._refill()
+        token_bucket._refill()
+    check(isinstance(error, RequestCancelled), f"a cancelled request raises RequestCancelled, got {error!r}")
+    check(stub.stats["requests"] == 0 and client.stats["cancelled"] == 1, f"a cancelled request is not sent, got {stub.stats['requests']} requests and stats {client.stats}")
+    check(client.concurrency.in_flight == 0 and client.concurrency.limit == 4, f"its concurrency slot is returned without growing the limit, got {client.concurrency.in_flight} in flight, limit {client.concurrency.limit}")
+    check(request_bucket._level == request_bucket.capacity and token_bucket._level == token_bucket.capacity,
+          f"its rate-limit budget is refunded, got {request_bucket._level} requests and {token_bucket._level} tokens")
+
+
+def main():
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    check_retry_after_parsing(check)
+    check_retries(check, (("retry-after-ms", "200"),), 0.4)
+    check_retries(check, (("retry-after", "1"),), 2.0)
+    check_retries(check, (("retry-after", "not a date"),), 0.0)
+    check_aimd(check)
+    check_cancelled(check)
+    print(f"{len(failures)} failed" if failures else "all checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
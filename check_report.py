@@ -0,0 +1,104 @@
+import sys
+
+import llm
+import report
+from bench import StubCompletionServer, synthetic_text
+from groq_client import ResilientGroq
+from models import SUPPORTED_MODELS
+from tokens import count_tokens
+
+# Checks of report.py's map-reduce reports against the local stub from bench.py, no Groq key needed:
+# window-sized splitting, grouping of partial summaries, the hierarchical reduce, the per-stage stats,
+# and generate_report's choice between one request and map-reduce.
+#
+#   python check_report.py
+
+MODEL = "llama3-8b-8192"
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+def check_split(check):
+    for label, text in (("English", synthetic_text(3000)), ("CJK", "数据库缓存的吞吐量和延迟。" * 2000)):
+        pieces = report.split_for_window(text, 800)
+        check("".join(pieces) == text, f"[{label}] the pieces join back into the text")
+        largest = max(count_tokens(piece) for piece in pieces)
+        check(len(pieces) > 1 and largest <= 800 * 1.05, f"[{label}] {len(pieces)} pieces of at most about 800 tokens, largest {largest}")
+
+
+def check_grouping(check):
+    partials = [f"partial {i} " + "word " * 300 for i in range(7)]
+    groups = report._group_partials(partials, 800)
+    check([partial for group in groups for partial in group] == partials, "grouping keeps every partial, in order")
+    check([len(group) for group in groups] == [2, 2, 2, 1], f"partials too big to share a window still pair up, got {[len(group) for group in groups]}")
+    small = ["word " * 50] * 10
+    groups = report._group_partials(small, 800)
+    check(len(groups) == 1, f"partials that fit one window make one group, got {len(groups)}")
+    check(len(report._group_partials(partials[:2], 10)) == 1, "two partials always merge, however small the window")
+
+
+# Every call succeeds and replies with reply_tokens words, so each level of the reduce halves the partials
+def check_map_reduce(check, client, stub, reply_tokens):
+    text = synthetic_text(3000)
+    chunk_tokens = 800
+    chunks = report.split_for_window(text, chunk_tokens)
+    summary, details, stats = report.map_reduce_report(client, text, "doc.txt", MODEL, SYSTEM_PROMPT, chunk_tokens, requests_per_second=0)
+    stages = stats["stages"]
+    names = [stage["stage"] for stage in stages]
+    calls = [stage["calls"] for stage in stages]
+    check(summary and details, "the report has a summary and details")
+    check(stats["chunks"] == len(chunks) and calls[0] == len(chunks), f"the map stage summarizes each of the {len(chunks)} chunks, got {calls[0]} calls")
+    check(names == ["map"] + [f"reduce {level}" for level in range(1, len(names) - 1)] + ["reduce final"] and len(names) >= 4,
+          f"partials are merged over several levels before the final report, got {names}")
+    check(all(later < earlier for earlier, later in zip(calls, calls[1:])) and calls[-1] == 1, f"every level makes fewer calls, got {calls}")
+    check(stub.stats["requests"] == sum(calls), f"one request per call, got {stub.stats['requests']} requests for {sum(calls)} calls")
+
+    # The stub reports its reply as reply_tokens words plus the summary/details break
+    for stage in stages:
+        expected = stage["calls"] * (reply_tokens + 1)
+        check(stage["completion_tokens"] == expected, f"[{stage['stage']}] completion tokens add up to {expected}, got {stage['completion_tokens']}")
+        check(stage["prompt_tokens"] > 0 and stage["seconds"] >= 0, f"[{stage['stage']}] prompt tokens and time are recorded, got {stage}")
+    map_context = sum(count_tokens(chunk) for chunk in chunks)
+    check(stages[0]["prompt_tokens"] >= map_context, f"map prompts carry every chunk ({map_context} tokens), got {stages[0]['prompt_tokens']}")
+    check(stats["prompt_tokens"] == sum(stage["prompt_tokens"] for stage in stages)
+          and stats["completion_tokens"] == sum(stage["completion_tokens"] for stage in stages), "report totals are the sums of the stages")
+    check(stats["wall_time"] >= max(stage["seconds"] for stage in stages), f"wall time covers every stage, got {stats['wall_time']}s")
+    formatted = report.format_report_stats(stats)
+    check(all(name in formatted for name in names), f"format_report_stats lists every stage: {formatted}")
+
+
+def check_generate_report(check, client, stub):
+    requests = stub.stats["requests"]
+    summary, details, stats = report.generate_report(client, synthetic_text(500), "small.txt", MODEL, SYSTEM_PROMPT)
+    check(stats is None and stub.stats["requests"] == requests + 1, f"a document within the context budget takes one request, got stats {stats}")
+    summary, details, stats = report.generate_report(client, synthetic_text(12000), "large.txt", MODEL, SYSTEM_PROMPT)
+    check(stats is not None and stats["chunks"] > 1, f"a document over the context budget is reported map-reduce style, got {stats and stats['chunks']} chunks")
+
+
+def main():
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    check_split(check)
+    check_grouping(check)
+    # Every call has to reach the stub, so the response cache is off and the client's rate limits are lifted
+    previous_cache = llm.get_response_cache()
+    llm.set_response_cache(None)
+    try:
+        reply_tokens = 300
+        with StubCompletionServer(latency=0.01, tokens_per_second=50000, reply_tokens=reply_tokens) as stub:
+            unlimited = {model: (10 ** 6, 10 ** 9) for model in SUPPORTED_MODELS.values()}
+            client = ResilientGroq(api_key="stub", base_url=stub.base_url, rate_limits=unlimited)
+            check_map_reduce(check, client, stub, reply_tokens)
+            check_generate_report(check, client, stub)
+    finally:
+        llm.set_response_cache(previous_cache)
+    print(f"{len(failures)} failed" if failures else "all checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
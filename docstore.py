@@ -0,0 +1,229 @@
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+def document_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Seconds a process directory must sit untouched before another process may remove it
+ABANDONED_AFTER = 60.0
+
+
+# Open `path` and lock it exclusively without waiting; the lock lasts as long as the returned file stays
+# open (or its process lives). None if another process holds it.
+def _try_lock(path, mode="a+b"):
+    try:
+        f = open(path, mode)
+    except OSError:
+        return None
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+# Process-wide store of extracted documents, deduplicated by content hash.
+# Text is kept zlib-compressed on disk and memory-mapped when read; a small LRU holds recently used texts.
+# Sessions hold only hashes, registered by passing their session_id to put(); a document is dropped when its last session releases it.
+class DocumentStore:
+    def __init__(self, store_dir, max_memory_chars=64 * 1024 * 1024):
+        self.max_memory_chars = max_memory_chars
+        self._refs = {}
+        self._memory = OrderedDict()
+        self._memory_chars = 0
+        self._lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+        # Processes sharing the cache directory each keep their documents in a directory of their own,
+        # locked for as long as the process lives, so none of them deletes another's files
+        self._remove_abandoned(store_dir)
+        self.store_dir = tempfile.mkdtemp(prefix="process-", dir=store_dir)
+        self._owner_lock = _try_lock(os.path.join(self.store_dir, ".lock"))
+        atexit.register(self.close)
+
+    # Directories of processes that exited: no session survives its process, so nothing in them is referenced
+    @staticmethod
+    def _remove_abandoned(store_dir):
+        for name in os.listdir(store_dir):
+            path = os.path.join(store_dir, name)
+            try:
+                if not name.startswith("process-") or time.time() - os.stat(path).st_mtime < ABANDONED_AFTER:
+                    continue
+            except OSError:
+                continue
+            # Held by a live owner, or not created yet by one still starting
+            owner_lock = _try_lock(os.path.join(path, ".lock"), "r+b")
+            if owner_lock is None:
+                continue
+            owner_lock.close()
+            shutil.rmtree(path, ignore_errors=True)
+
+    # Drop this process's documents; called at exit
+    def close(self):
+        if self._owner_lock is not None:
+            self._owner_lock.close()
+            self._owner_lock = None
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+
+    def _path(self, doc_hash):
+        return os.path.join(self.store_dir, f"{doc_hash}.z")
+
+    def _remember(self, doc_hash, text):
+        if doc_hash in self._memory:
+            self._memory.move_to_end(doc_hash)
+            return
+        self._memory[doc_hash] = text
+        self._memory_chars += len(text)
+        while self._memory_chars > self.max_memory_chars and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_chars -= len(evicted)
+
+    def _forget(self, doc_hash):
+        text = self._memory.pop(doc_hash, None)
+        if text is not None:
+            self._memory_chars -= len(text)
+
+    # Store text (once per distinct content) and return its hash. Given a session_id, the session's reference
+    # is taken under the same lock, so another session releasing the same content cannot delete it in between.
+    def put(self, text, session_id=None):
+        doc_hash = document_hash(text)
+        with self._lock:
+            path = self._path(doc_hash)
+            if not os.path.exists(path):
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(zlib.compress(text.encode("utf-8")))
+                os.replace(tmp_path, path)
+            self._remember(doc_hash, text)
+            if session_id is not None:
+                self._refs.setdefault(doc_hash, set()).add(session_id)
+        return doc_hash
+
+    def get(self, doc_hash):
+        with self._lock:
+            if doc_hash in self._memory:
+                self._memory.move_to_end(doc_hash)
+                return self._memory[doc_hash]
+            with open(self._path(doc_hash), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                text = zlib.decompress(mapped).decode("utf-8")
+            self._remember(doc_hash, text)
+            return text
+
+    def release(self, session_id, doc_hash):
+        with self._lock:
+            sessions = self._refs.get(doc_hash)
+            if sessions is None:
+                return
+            sessions.discard(session_id)
+            if not sessions:
+                del self._refs[doc_hash]
+                self._forget(doc_hash)
+                try:
+                    os.remove(self._path(doc_hash))
+                except OSError:
+                    pass
+
+    def release_session(self, session_id):
+        with self._lock:
+            held = [doc_hash for doc_hash, sessions in self._refs.items() if session_id in sessions]
+        for doc_hash in held:
+            self.release(session_id, doc_hash)
+
+    def stats(self):
+        with self._lock:
+            return {"documents": len(self._refs), "references": sum(len(sessions) for sessions in self._refs.values()),
+                    "memory_chars": self._memory_chars}
+
+
+# Conversations persisted in SQLite, one row per conversation and grouped by workspace,
+# plus an append-only log of each conversation's messages numbered from 0.
+# Sessions sharing a workspace only ever write the conversations they changed, deleted or renamed.
+class ConversationStore:
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute("CREATE TABLE IF NOT EXISTS conversations (workspace TEXT NOT NULL, name TEXT NOT NULL, data TEXT NOT NULL, "
+                         "updated REAL NOT NULL, PRIMARY KEY (workspace, name))")
+        self._db.execute("CREATE TABLE IF NOT EXISTS messages (workspace TEXT NOT NULL, conversation TEXT NOT NULL, seq INTEGER NOT NULL, "
+                         "role TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (workspace, conversation, seq))")
+        self._db.commit()
+
+    def load(self, workspace):
+        with self._lock:
+            rows = self._db.execute("SELECT name, data FROM conversations WHERE workspace = ? ORDER BY name", (workspace,)).fetchall()
+        return {name: json.loads(data) for name, data in rows}
+
+    # Insert or update the given conversations; conversations not passed are left as they are, since
+    # other sessions may be working in the same workspace
+    def save(self, workspace, conversations):
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO conversations (workspace, name, data, updated) VALUES (?, ?, ?, ?)",
+                                     [(workspace, name, json.dumps(data), now) for name, data in conversations.items()])
+
+    # Remove a conversation and its message log
+    def delete(self, workspace, conversation):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM conversations WHERE workspace = ? AND name = ?", (workspace, conversation))
+                self._db.execute("DELETE FROM messages WHERE workspace = ? AND conversation = ?", (workspace, conversation))
+
+    # Append messages ({"role", "content"}) to the end of a conversation's log
+    def append_messages(self, workspace, conversation, messages):
+        now = time.time()
+        with self._lock:
+            with self._db:
+                (next_seq,) = self._db.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE workspace = ? AND conversation = ?",
+                                               (workspace, conversation)).fetchone()
+                self._db.executemany("INSERT INTO messages (workspace, conversation, seq, role, content, created) VALUES (?, ?, ?, ?, ?, ?)",
+                                     [(workspace, conversation, next_seq + i, message["role"], message["content"], now) for i, message in enumerate(messages)])
+
+    # Replace the last len(messages) messages of a conversation's log (a regenerated turn), keeping their numbers
+    def replace_last_messages(self, workspace, conversation, messages):
+        now = time.time()
+        with self._lock:
+            with self._db:
+                (next_seq,) = self._db.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE workspace = ? AND conversation = ?",
+                                               (workspace, conversation)).fetchone()
+                start = max(0, next_seq - len(messages))
+                self._db.execute("DELETE FROM messages WHERE workspace = ? AND conversation = ? AND seq >= ?", (workspace, conversation, start))
+                self._db.executemany("INSERT INTO messages (workspace, conversation, seq, role, content, created) VALUES (?, ?, ?, ?, ?, ?)",
+                                     [(workspace, conversation, start + i, message["role"], message["content"], now) for i, message in enumerate(messages)])
+
+    # Move a conversation and its log to a new name, replacing any conversation already under that name
+    def rename(self, workspace, conversation, new_name):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM conversations WHERE workspace = ? AND name = ?", (workspace, new_name))
+                self._db.execute("UPDATE conversations SET name = ?, updated = ? WHERE workspace = ? AND name = ?",
+                                 (new_name, time.time(), workspace, conversation))
+                self._db.execute("DELETE FROM messages WHERE workspace = ? AND conversation = ?", (workspace, new_name))
+                self._db.execute("UPDATE messages SET conversation = ? WHERE workspace = ? AND conversation = ?", (new_name, workspace, conversation))
+
+    # Messages of a conversation from number `start` on, oldest first
+    def load_messages(self, workspace, conversation, start=0):
+        with self._lock:
+            rows = self._db.execute("SELECT role, content FROM messages WHERE workspace = ? AND conversation = ? AND seq >= ? ORDER BY seq",
+                                    (workspace, conversation, start)).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
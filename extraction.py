@@ -0,0 +1,342 @@
+import codecs
+import concurrent.futures
+import hashlib
+import io
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures.process import BrokenProcessPool
+
+import tracing
+
+# PyPDF2, docx and chardet are imported by the functions that use them, so importing this module
+# (and starting the app) does not pay for parsers until a file of that type arrives
+
+# Bump whenever extract_text_from_file changes its output so stale cache entries are ignored
+EXTRACTOR_VERSION = "3"
+
+# Seconds a single PDF page may spend in extract_text() before it is skipped
+PAGE_TIMEOUT = 20.0
+# PDF pages handed to a worker process per task
+PDF_PAGES_PER_CHUNK = 8
+# Bytes of a .txt file sniffed by chardet and decoded per yielded piece
+TXT_BLOCK_SIZE = 256 * 1024
+# Paragraphs of a .docx file per yielded piece
+DOCX_PARAGRAPHS_PER_PIECE = 200
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PageTimeout(Exception):
+    pass
+
+
+# Placeholder text for a page that could not be extracted (timed out, or its worker died)
+class SkippedPage(str):
+    pass
+
+
+# Extracted text with skipped pages in it; never cached, so the next request extracts the document again
+class IncompleteText(str):
+    skipped_pages = 0
+
+
+def _raise_page_timeout(signum, frame):
+    raise PageTimeout()
+
+
+# Extract one PDF page, giving up after page_timeout seconds where SIGALRM is usable (worker processes)
+def _extract_page(page, page_number, page_timeout):
+    if not page_timeout or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        return page.extract_text() or ""
+    previous = signal.signal(signal.SIGALRM, _raise_page_timeout)
+    signal.setitimer(signal.ITIMER_REAL, page_timeout)
+    try:
+        return page.extract_text() or ""
+    except PageTimeout:
+        return SkippedPage(f"[page {page_number} skipped: text extraction timed out]")
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+# Worker-side reader cache so consecutive chunks of the same file skip re-parsing the xref table
+_worker_reader = (None, None)
+
+
+def _extract_pdf_chunk(path, start, stop, page_timeout):
+    global _worker_reader
+    if _worker_reader[0] != path:
+        import PyPDF2
+
+        _worker_reader = (path, PyPDF2.PdfReader(path))
+    reader = _worker_reader[1]
+    return [_extract_page(reader.pages[i], i + 1, page_timeout) for i in range(start, stop)]
+
+
+def _get_pool(max_workers=None):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork: the Streamlit server process is multi-threaded
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers or os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+# Drop the shared pool, killing its workers if one of them is stuck on a page. Only `pool` is dropped:
+# if another caller already replaced it, the replacement is left alone. Returns whether it was dropped.
+def _reset_pool(pool, kill=False):
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return False
+        _pool = None
+    if kill:
+        for process in list(getattr(pool, "_processes", {}).values()):
+            process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+    return True
+
+
+# Submit pages [start, stop) to the current pool, returning the pool alongside the future so a failure
+# can later be told apart from another caller's reset
+def _submit_chunk(path, start, stop, page_timeout, max_workers):
+    while True:
+        pool = _get_pool(max_workers)
+        try:
+            return pool, pool.submit(_extract_pdf_chunk, path, start, stop, page_timeout)
+        except (RuntimeError, BrokenProcessPool):
+            # Shut down or broken between _get_pool and submit
+            _reset_pool(pool)
+
+
+# Seconds between checks on a chunk that has not finished yet
+_POLL_SECONDS = 0.25
+
+
+# Wait for a chunk, counting the backstop timeout from when a worker picked it up rather than from when
+# it was submitted, so time spent queued behind other callers' chunks does not count against it
+def _chunk_result(future, timeout):
+    if not timeout:
+        return future.result()
+    started = None
+    while True:
+        # result() rather than wait(): a future cancelled by a pool shutdown never shows up as done in wait()
+        try:
+            return future.result(timeout=_POLL_SECONDS)
+        except concurrent.futures.TimeoutError:
+            pass
+        now = time.monotonic()
+        if started is None:
+            if future.running():
+                started = now
+        elif now - started > timeout:
+            raise concurrent.futures.TimeoutError()
+
+
+def _iter_pdf_pages(file_content, page_timeout, pages_per_chunk, max_workers):
+    import PyPDF2
+
+    page_count = len(PyPDF2.PdfReader(io.BytesIO(file_content)).pages)
+    ranges = [(start, min(start + pages_per_chunk, page_count)) for start in range(0, page_count, pages_per_chunk)]
+    # Workers read the PDF from disk instead of having the bytes pickled into every task
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        f.write(file_content)
+    # At most this many chunks are in flight, so memory stays bounded however long the document is
+    max_pending = 2 * (max_workers or os.cpu_count() or 1)
+    # (start, stop, pool, future, retried)
+    pending = deque()
+    next_range = 0
+    try:
+        while pending or next_range < len(ranges):
+            while next_range < len(ranges) and len(pending) < max_pending:
+                start, stop = ranges[next_range]
+                pending.append((start, stop, *_submit_chunk(path, start, stop, page_timeout, max_workers), False))
+                next_range += 1
+            start, stop, pool, future, retried = pending.popleft()
+            texts = None
+            retry = False
+            try:
+                texts = _chunk_result(future, page_timeout * (stop - start) + 5.0 if page_timeout else None)
+            except concurrent.futures.TimeoutError:
+                # A page is stuck past its own alarm; only killing the workers frees it. Chunks of ours
+                # still queued on that pool fail with it and are resubmitted below as they come up.
+                _reset_pool(pool, kill=True)
+            except concurrent.futures.CancelledError:
+                # Another caller reset the pool before a worker picked this chunk up
+                retry = True
+            except BrokenProcessPool:
+                # Either another caller reset the pool (it is no longer current) and the chunk is not at
+                # fault, or a worker died under it; the latter gets one more try on a fresh pool
+                reset_here = _reset_pool(pool)
+                retry = not (reset_here and retried)
+                retried = retried or reset_here
+            if texts is None and retry:
+                pending.appendleft((start, stop, *_submit_chunk(path, start, stop, page_timeout, max_workers), retried))
+                continue
+            if texts is None:
+                texts = [SkippedPage(f"[page {i + 1} skipped: text extraction failed]") for i in range(start, stop)]
+            for i, text in enumerate(texts, start + 1):
+                piece = text if i == 1 else "\n" + text
+                yield i, page_count, SkippedPage(piece) if isinstance(text, SkippedPage) else piece
+    finally:
+        for _, _, _, future, _ in pending:
+            future.cancel()
+        os.remove(path)
+
+
+def _iter_txt_pieces(file_content, block_size):
+    import chardet
+
+    # Sniffing a prefix is enough for chardet; ascii is widened to utf-8 in case non-ascii text appears later
+    encoding = chardet.detect(file_content[:block_size])['encoding'] or 'utf-8'
+    if encoding.lower() == 'ascii':
+        encoding = 'utf-8'
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    piece_count = max(1, -(-len(file_content) // block_size))
+    for i in range(piece_count):
+        block = file_content[i * block_size:(i + 1) * block_size]
+        yield i + 1, piece_count, decoder.decode(block, final=i == piece_count - 1)
+
+
+def _iter_docx_pieces(file_content, paragraphs_per_piece):
+    import docx
+
+    paragraphs = docx.Document(io.BytesIO(file_content)).paragraphs
+    piece_count = max(1, -(-len(paragraphs) // paragraphs_per_piece))
+    for i in range(piece_count):
+        batch = paragraphs[i * paragraphs_per_piece:(i + 1) * paragraphs_per_piece]
+        text = "\n".join(paragraph.text for paragraph in batch)
+        yield i + 1, piece_count, text if i == 0 else "\n" + text
+
+
+# Stream text out of an uploaded file as (piece_number, piece_count, text) tuples.
+# Pieces are PDF pages, .txt blocks or .docx paragraph batches; "".join of the texts is the whole document.
+# Pages that could not be extracted come through as SkippedPage placeholders.
+def iter_extracted_pages(file_content, file_name, page_timeout=PAGE_TIMEOUT, max_workers=None):
+    if file_name.endswith('.txt'):
+        yield from _iter_txt_pieces(file_content, TXT_BLOCK_SIZE)
+    elif file_name.endswith('.pdf'):
+        yield from _iter_pdf_pages(file_content, page_timeout, PDF_PAGES_PER_CHUNK, max_workers)
+    elif file_name.endswith('.docx'):
+        yield from _iter_docx_pieces(file_content, DOCX_PARAGRAPHS_PER_PIECE)
+    else:
+        yield 1, 1, "Unsupported file type"
+
+
+# Function to extract text from uploaded files; returns an IncompleteText if any page was skipped
+def extract_text_from_file(file_content, file_name, on_page=None):
+    with tracing.span("extraction.extract", format=os.path.splitext(file_name)[1].lstrip(".").lower(), bytes=len(file_content)) as span:
+        pieces = []
+        skipped_pages = 0
+        for page_number, page_count, text in iter_extracted_pages(file_content, file_name):
+            pieces.append(text)
+            skipped_pages += isinstance(text, SkippedPage)
+            if on_page:
+                on_page(page_number, page_count, text)
+        text = "".join(pieces)
+        if skipped_pages:
+            text = IncompleteText(text)
+            text.skipped_pages = skipped_pages
+        span.set(pieces=len(pieces), chars=len(text), skipped_pages=skipped_pages)
+        return text
+
+
+# Content-addressed key: same bytes + same extractor + same file type -> same text
+def extraction_key(file_content, file_name):
+    digest = hashlib.sha256()
+    digest.update(EXTRACTOR_VERSION.encode())
+    digest.update(os.path.splitext(file_name)[1].lower().encode())
+    digest.update(b"\0")
+    digest.update(file_content)
+    return digest.hexdigest()
+
+
+# Two-tier cache of extracted text: an in-memory LRU in front of a size-bounded directory on disk
+class ExtractionCache:
+    def __init__(self, cache_dir, max_memory_entries=32, max_disk_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt.z")
+
+    def _remember(self, key, text):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    text = zlib.decompress(f.read()).decode("utf-8")
+            except (OSError, zlib.error, UnicodeDecodeError):
+                return None
+            # Touch the file so disk eviction sees it as recently used
+            os.utime(path, None)
+            self._remember(key, text)
+            return text
+
+    def put(self, key, text):
+        with self._lock:
+            self._remember(key, text)
+            path = self._path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(text.encode("utf-8")))
+            os.replace(tmp_path, path)
+            self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".txt.z"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def get_or_extract(self, file_content, file_name, on_page=None):
+        with tracing.span("extraction.get_or_extract", file_name=file_name) as span:
+            key = extraction_key(file_content, file_name)
+            text = self.get(key)
+            span.set(cache_hit=text is not None)
+            if text is None:
+                text = extract_text_from_file(file_content, file_name, on_page=on_page)
+                if not isinstance(text, IncompleteText):
+                    self.put(key, text)
+            return text
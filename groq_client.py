@@ -0,0 +1,242 @@
+import email.utils
+import random
+import threading
+import time
+
+import groq
+import httpx
+
+import tracing
+from tokens import count_message_tokens
+
+# Per-model limits as (requests per minute, tokens per minute); keys are the ids in SUPPORTED_MODELS
+MODEL_RATE_LIMITS = {
+    "llama3-70b-8192": (30, 6000),
+    "llama3-8b-8192": (30, 30000),
+    "llama-3.1-70b-versatile": (30, 20000),
+    "llama-3.1-8b-instant": (30, 20000),
+    "mixtral-8x7b-32768": (30, 5000),
+    "gemma2-9b-it": (30, 15000),
+}
+DEFAULT_RATE_LIMIT = (30, 6000)
+
+# Errors worth another attempt; anything else (bad request, auth) fails immediately
+RETRYABLE_ERRORS = (groq.RateLimitError, groq.APIConnectionError, groq.APITimeoutError, groq.InternalServerError)
+
+
+# Raised instead of sending a request whose caller gave up on it while it waited for a slot
+class RequestCancelled(Exception):
+    pass
+
+
+# Token bucket holding up to `capacity` units and refilling at `rate` units per second
+class TokenBucket:
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # Block until `amount` units are available and take them; returns the seconds spent waiting
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._level >= amount:
+                    self._level -= amount
+                    return waited
+                delay = (amount - self._level) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    # Correct an earlier estimate once the real cost is known (positive delta takes more)
+    def adjust(self, delta):
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level - delta)
+
+
+# Additive-increase / multiplicative-decrease cap on requests in flight.
+# Like TCP's one cut per round trip, overload reported by a request sent before the last decrease
+# belongs to the congestion that decrease already answered, so a burst of 429s halves the limit once.
+class AIMDLimiter:
+    def __init__(self, initial=4, minimum=1, maximum=16, decrease_factor=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.last_decrease = None
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        started = time.monotonic()
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return time.monotonic() - started
+
+    # sent: time.monotonic() when the request went out; without it every overload counts
+    def release(self, overloaded=False, sent=None):
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                if sent is None or self.last_decrease is None or sent >= self.last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self.last_decrease = time.monotonic()
+            else:
+                # Grows by about one slot per window of successful requests
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    # Hand back a slot whose request was never sent, leaving the limit as it was
+    def cancel(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+
+# Seconds the server asked us to wait, from Retry-After-Ms or Retry-After (delta seconds or HTTP date)
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000.0)
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            parsed = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            # Neither seconds nor an HTTP date; the caller falls back to its own backoff
+            return None
+        return max(0.0, parsed.timestamp() - time.time())
+    return None
+
+
+# Drop-in replacement for groq.Groq: client.chat.completions.create(...) gains pooling, rate limiting,
+# retries with jittered exponential backoff, and an adaptive concurrency limit shared by every caller.
+class ResilientGroq:
+    def __init__(self, api_key=None, base_url=None, rate_limits=MODEL_RATE_LIMITS, max_retries=4, backoff_base=0.5, backoff_max=30.0,
+                 timeout=60.0, max_connections=32, initial_concurrency=4, max_concurrency=16):
+        self._client = groq.Groq(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            timeout=httpx.Timeout(timeout, connect=5.0),
+            http_client=groq.DefaultHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            ),
+        )
+        self.rate_limits = rate_limits
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.concurrency = AIMDLimiter(initial=initial_concurrency, maximum=max_concurrency)
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "cancelled": 0, "queue_wait": 0.0}
+        self._stats_lock = threading.Lock()
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self.chat = _Chat(self)
+
+    def _model_buckets(self, model_id):
+        with self._buckets_lock:
+            if model_id not in self._buckets:
+                requests_per_minute, tokens_per_minute = self.rate_limits.get(model_id, DEFAULT_RATE_LIMIT)
+                self._buckets[model_id] = (TokenBucket(requests_per_minute, requests_per_minute / 60.0),
+                                           TokenBucket(tokens_per_minute, tokens_per_minute / 60.0))
+            return self._buckets[model_id]
+
+    def _count(self, **amounts):
+        with self._stats_lock:
+            for name, amount in amounts.items():
+                self.stats[name] += amount
+
+    def _backoff(self, attempt, error):
+        # Full jitter, but never sooner than the server asked for
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = retry_after_seconds(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    # `cancelled` is an optional callable checked once a slot is acquired (e.g. the losers of a routing race):
+    # when it returns True the slot and the rate-limit budget are handed back and RequestCancelled is raised
+    def create_chat_completion(self, cancelled=None, **kwargs):
+        model_id = kwargs["model"]
+        request_bucket, token_bucket = self._model_buckets(model_id)
+        estimated_tokens = count_message_tokens(kwargs["messages"]) + kwargs.get("max_tokens", 0)
+        span = tracing.current_span()
+        attempt = 0
+        while True:
+            waited = request_bucket.acquire(1)
+            waited += token_bucket.acquire(estimated_tokens)
+            waited += self.concurrency.acquire()
+            span.add(queue_wait=waited)
+            if cancelled is not None and cancelled():
+                self.concurrency.cancel()
+                request_bucket.adjust(-1)
+                token_bucket.adjust(-estimated_tokens)
+                self._count(cancelled=1, queue_wait=waited)
+                span.set(cancelled=True)
+                raise RequestCancelled(f"{model_id} request cancelled before it was sent")
+            self._count(requests=1, queue_wait=waited)
+            sent = time.monotonic()
+            try:
+                response = self._client.chat.completions.create(**kwargs)
+            except RETRYABLE_ERRORS as error:
+                overloaded = isinstance(error, (groq.RateLimitError, groq.APITimeoutError))
+                self.concurrency.release(overloaded=overloaded, sent=sent)
+                if isinstance(error, groq.RateLimitError):
+                    self._count(rate_limited=1)
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt, error))
+                attempt += 1
+                self._count(retries=1)
+                span.add(retries=1)
+                continue
+            except Exception:
+                self.concurrency.release()
+                raise
+            if kwargs.get("stream"):
+                # The connection stays busy until the stream is drained
+                return self._release_after(response)
+            self.concurrency.release()
+            usage = getattr(response, "usage", None)
+            if usage is not None and getattr(usage, "total_tokens", None):
+                token_bucket.adjust(usage.total_tokens - estimated_tokens)
+            return response
+
+    def _release_after(self, stream):
+        try:
+            yield from stream
+        finally:
+            self.concurrency.release()
+            if hasattr(stream, "close"):
+                stream.close()
+
+
+class _Completions:
+    def __init__(self, owner):
+        self.create = owner.create_chat_completion
+
+
+class _Chat:
+    def __init__(self, owner):
+        self.completions = _Completions(owner)
@@ -1,219 +1,351 @@
 import streamlit as st
 import os
 import time
-from groq import Groq
-import io
-import chardet
-import PyPDF2
-import docx
-
-# Supported models
-SUPPORTED_MODELS = {
-    "Llama 3 70B": "llama3-70b-8192",
-    "Llama 3 8B": "llama3-8b-8192",
-    "Llama 3.1 70B": "llama-3.1-70b-versatile",
-    "Llama 3.1 8B": "llama-3.1-8b-instant",
-    "Mixtral 8x7B": "mixtral-8x7b-32768",
-    "Gemma 2 9B": "gemma2-9b-it"
-}
+import json
+import uuid
+import weakref
+import llm
+import memory
+import reasoning
+import report
+import tracing
+from router import ROUTING_PREFERENCES, ModelRouter
+from docstore import ConversationStore, DocumentStore
+from extraction import ExtractionCache, IncompleteText
+from groq_client import ResilientGroq
+from llm import ResponseCache
+from models import SUPPORTED_MODELS
+from retrieval import ChunkIndex, context_token_budget
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from tokens import count_document_tokens
+
+# Seconds a cached model response may be replayed for an identical request
+RESPONSE_CACHE_TTL = int(os.getenv("GSEARCH_RESPONSE_TTL", 24 * 3600))
 
 # Initialize Groq client with API key
 groq_api_key = os.getenv("GROQ_API_KEY")
-if not groq_api_key:
+# GROQ_BASE_URL points the app at another endpoint (e.g. the stub server in bench.py), which needs no real key
+groq_base_url = os.getenv("GROQ_BASE_URL")
+if not groq_api_key and not groq_base_url:
     st.error("GROQ_API_KEY not found in environment variables. Please set it and restart the app.")
     st.stop()
 
-client = Groq(api_key=groq_api_key)
-
-# Function to extract text from uploaded files
-def extract_text_from_file(file_content, file_name):
-    if file_name.endswith('.txt'):
-        encoding = chardet.detect(file_content)['encoding']
-        return file_content.decode(encoding or 'utf-8', errors='replace')
-    elif file_name.endswith('.pdf'):
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-        return "\n".join(page.extract_text() for page in pdf_reader.pages)
-    elif file_name.endswith('.docx'):
-        doc = docx.Document(io.BytesIO(file_content))
-        return "\n".join(paragraph.text for paragraph in doc.paragraphs)
-    else:
-        return "Unsupported file type"
-
-# Enhanced System Prompt Logic
-def enhanced_system_prompt(query):
-    prompt = f"""
-    <thinking>
-    1. Begin analyzing the question: "{query}"
-    2. Plan of action:
-        a. Briefly outline the approach.
-        b. Present a step-by-step reasoning process.
-        c. Use "Chain of Thought" reasoning if needed, breaking it into steps.
-        d. Consider alternative solutions if applicable.
-    </thinking>
-
-    <reflection>
-    1. Review reasoning.
-    2. Check for potential errors, optimizations, or enhancements.
-    3. Reflect on alternative approaches, if any.
-    </reflection>
-
-    <output>
-    Provide final answer based on the above reasoning and reflection.
-    </output>
-    """
-    return prompt
-
-# Function to handle multi-path reasoning using the ReAct framework
-def multi_path_reasoning(selected_task):
-    if selected_task == "Research and Information Retrieval":
-        return """
-        Thought 1: I need to gather detailed information about the impact of climate change on coastal cities. 
-        Act 1: Search["impact of climate change on coastal cities"] 
-        Obs 1: The search results include scientific articles, government reports, and case studies on the impact of rising sea levels on coastal cities.
-        Thought 2: The information seems scattered. I need to focus on retrieving case studies from government reports.
-        Act 2: Search["case studies from government reports on rising sea levels"] 
-        Obs 2: Found multiple case studies from NOAA and the EPA detailing the impact on specific cities. 
-        Thought 3: I have enough case studies but need to summarize key points.
-        Act 3: Summarize["key points from case studies on rising sea levels"] 
-        Act 4: Finish[summary of key points]
-        """
-    elif selected_task == "Code Debugging":
-        return """
-        Thought 1: I need to debug a Python script that’s throwing a TypeError.
-        Act 1: Review["Python script TypeError"] 
-        Obs 1: The TypeError is due to a mismatch in data types when calling a function.
-        Thought 2: I should identify the exact line causing the error and check the data types involved.
-        Act 2: Inspect["line of code causing TypeError and data types"] 
-        Obs 2: The error is occurring because an integer is being passed where a string is expected.
-        Thought 3: I need to correct the data type mismatch and rerun the script.
-        Act 3: Modify["correct data type from integer to string"] 
-        Act 4: Finish[rerun the script]
-        """
-    elif selected_task == "Content Generation":
-        return """
-        Thought 1: I need to write a blog post on the benefits of AI in healthcare.
-        Act 1: Generate["outline for blog post on AI in healthcare"] 
-        Obs 1: The outline includes sections on diagnostic tools, personalized medicine, and operational efficiency.
-        Thought 2: I should expand the section on personalized medicine with examples.
-        Act 2: Research["examples of personalized medicine using AI"] 
-        Obs 2: Found examples of AI-driven treatments for cancer and diabetes.
-        Thought 3: I can now draft the personalized medicine section with these examples.
-        Act 3: Write["draft section on personalized medicine with AI examples"] 
-        Act 4: Finish[draft complete]
-        """
-    elif selected_task == "Strategic Planning":
-        return """
-        Thought 1: I need to develop a strategic plan for increasing customer retention.
-        Act 1: Identify["key factors affecting customer retention"] 
-        Obs 1: Key factors include product satisfaction, customer support quality, and engagement strategies.
-        Thought 2: I should focus on improving customer support and engagement strategies.
-        Act 2: Develop["action plan for improving customer support and engagement"] 
-        Obs 2: Created a plan including personalized communication, regular feedback loops, and loyalty programs.
-        Thought 3: I need to present this plan to the executive team.
-        Act 3: Prepare["presentation for executive team on customer retention strategies"] 
-        Act 4: Finish[presentation ready]
-        """
-    return ""
-
-# Function to handle advanced steps: prompt improvement, response, review, and analysis
-def advanced_steps(query, model_id):
+# One pooled, rate-limited client per process so limits hold across every session
+@st.cache_resource(show_spinner=False)
+def get_client():
+    return ResilientGroq(api_key=groq_api_key or "unused", base_url=groq_base_url)
+
+client = get_client()
+
+# Tracing is off unless GSEARCH_TRACING=1 or GSEARCH_TRACE_FILE (an OTLP/JSON lines file to append spans to) is set
+TRACE_FILE = os.getenv("GSEARCH_TRACE_FILE")
+TRACING_ENABLED = bool(TRACE_FILE) or os.getenv("GSEARCH_TRACING", "") not in ("", "0")
+
+@st.cache_resource(show_spinner=False)
+def get_tracer():
+    return tracing.Tracer(export_path=TRACE_FILE) if TRACING_ENABLED else None
+
+tracing.set_tracer(get_tracer())
+script_ctx = get_script_run_ctx()
+# Spans opened during this run nest under it; a run cut short by st.stop() or an exception is not recorded
+rerun_span = tracing.start_span("streamlit.rerun", root=True, session=script_ctx.session_id if script_ctx else None)
+
+# Directory for caches that should survive app restarts
+CACHE_DIR = os.getenv("GSEARCH_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# One extraction cache per process, shared by every session and rerun.
+# Its memory tier stays small because the document store already keeps recently used texts.
+@st.cache_resource
+def get_extraction_cache():
+    return ExtractionCache(os.path.join(CACHE_DIR, "extraction"), max_memory_entries=4)
+
+# Extracted documents shared by every session; sessions only keep content hashes
+@st.cache_resource
+def get_document_store():
+    return DocumentStore(os.path.join(CACHE_DIR, "documents"))
+
+@st.cache_resource
+def get_conversation_store():
+    return ConversationStore(os.path.join(CACHE_DIR, "conversations.sqlite3"))
+
+# Releases a session's documents from the shared store once Streamlit drops the session state
+class SessionDocuments:
+    def __init__(self, store, session_id):
+        self.session_id = session_id
+        weakref.finalize(self, store.release_session, session_id)
+
+# Text of an uploaded file, loaded from the shared store by its handle
+def document_text(file_name):
     try:
-        # Step 1: Improve the original prompt
-        with st.spinner("Improving the prompt..."):
-            improved_prompt_response = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "You are an expert at refining prompts."},
-                    {"role": "user", "content": f"Please improve the following prompt for optimal results:\n{query}"}
-                ],
-                model=model_id,
-                max_tokens=500,
-            )
-            improved_prompt = improved_prompt_response.choices[0].message.content
-
-        # Step 2: Get the response for the improved prompt
-        with st.spinner("Generating response for the improved prompt..."):
-            response = client.chat.completions.create(
-                messages=[{"role": "user", "content": improved_prompt}],
-                model=model_id,
-                max_tokens=1000,
-            )
-            generated_response = response.choices[0].message.content
-
-        # Step 3: Review and grade the response
-        with st.spinner("Reviewing and grading the response..."):
-            review_response = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "You are an expert reviewer and grader."},
-                    {"role": "user", "content": f"Please review and grade the following response:\n{generated_response}"}
-                ],
-                model=model_id,
-                max_tokens=500,
-            )
-            review_feedback = review_response.choices[0].message.content
-
-        # Step 4: Analyze and summarize review points and responses
-        with st.spinner("Analyzing and summarizing review points..."):
-            analysis_response = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "You are an expert in summarizing and analyzing feedback."},
-                    {"role": "user", "content": f"Please analyze and summarize the following review feedback:\n{review_feedback}"}
-                ],
-                model=model_id,
-                max_tokens=500,
-            )
-            analysis_summary = analysis_response.choices[0].message.content
-
-        return improved_prompt, generated_response, review_feedback, analysis_summary
+        return get_document_store().get(st.session_state.files[file_name])
+    except FileNotFoundError:
+        del st.session_state.files[file_name]
+        st.warning(f"File {file_name} is no longer available, please upload it again.")
+        return ""
 
-    except Exception as e:
-        st.error(f"An error occurred during advanced steps: {str(e)}")
-        return None, None, None, None
+# One response cache per process, persisted next to the extraction cache
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(os.path.join(CACHE_DIR, "responses.sqlite3"), ttl=RESPONSE_CACHE_TTL)
+
+# One model router per process, so every session's calls feed the same latency and throughput stats.
+# GSEARCH_ROUTER_LOG names a JSONL file that every routing decision is appended to.
+@st.cache_resource
+def get_router():
+    return ModelRouter(log_path=os.getenv("GSEARCH_ROUTER_LOG"))
+
+# Routing policy from the sidebar settings of this session
+def current_route():
+    return get_router().policy(st.session_state.routing_preference, st.session_state.speculative_routing)
+
+# One retrieval index per stored document, shared by every session and keyed by the store's hash.
+# The index holds no text: selections are sliced from the text the caller got from the document store.
+@st.cache_resource(max_entries=32)
+def get_retrieval_index(doc_hash, _text):
+    return ChunkIndex(_text)
+
+# Headings for the streamed advanced steps output
+ADVANCED_STEP_LABELS = {
+    "improve": "Improving the prompt...",
+    "respond": "Generating response for the improved prompt...",
+    "review": "Reviewing and grading the response...",
+    "analyze": "Analyzing and summarizing review points...",
+}
+
+# Spinner text for each reasoning type
+REASONING_SPINNERS = {
+    "Single-path": "Searching and summarizing...",
+    "Multi-path": "Searching and summarizing...",
+    "Advance Steps": "Executing advanced steps...",
+    "Enhanced System Prompt": "Generating enhanced prompt response...",
+}
+
+# Messages of a conversation not yet folded into its rolling summary, loaded from the log once per session
+def conversation_tail(name):
+    if name not in st.session_state.message_tails:
+        conversation_memory = st.session_state.conversations[name].setdefault("memory", memory.new_memory())
+        st.session_state.message_tails[name] = get_conversation_store().load_messages(workspace, name, conversation_memory["summarized"])
+    return st.session_state.message_tails[name]
+
+# on_delta callback for reasoning.run_query that shows the Advance Steps stage being streamed in `placeholder`
+def stage_stream_display(placeholder):
+    streamed = {"stage": None, "text": "", "rendered": 0.0}
 
-# Function to search and summarize using Groq API
-def search_and_summarize(query, model_id, system_prompt, context="", reasoning_type="Single-path", selected_task=None):
+    def show_delta(stage, delta):
+        if stage != streamed["stage"]:
+            streamed.update(stage=stage, text="")
+        streamed["text"] += delta
+        # Redraw at most every 50ms; every token would flood the websocket
+        if time.perf_counter() - streamed["rendered"] > 0.05:
+            placeholder.markdown(f"**{ADVANCED_STEP_LABELS[stage]}**\n\n{streamed['text']}")
+            streamed["rendered"] = time.perf_counter()
+
+    return show_delta
+
+# Function to answer a query in the active conversation with the selected model and reasoning type.
+# With remember set the query sees the conversation so far and the turn is appended to its log.
+# With replace_last_turn (Regenerate) the last logged turn is left out of that history and replaced by the new one.
+# file_name, when given, is an uploaded file whose best-matching chunks go with the query as context
+def answer_query(query, file_name=None, bypass_cache=False, remember=True, replace_last_turn=False):
+    name = st.session_state.active_conversation
+    conversation = st.session_state.conversations[name]
+    model_id = SUPPORTED_MODELS[st.session_state.selected_model]
+    reasoning_type = st.session_state.reasoning_type
+    selected_task = st.session_state.selected_task if reasoning_type == "Multi-path" else None
+    conversation.pop("run_stats", None)
+    timings = {}
+    placeholder = st.empty()
+    show_delta = stage_stream_display(placeholder)
     try:
-        with st.spinner("Searching and summarizing..."):
-            if reasoning_type == "Multi-path" and selected_task:
-                prompt = multi_path_reasoning(selected_task)
-                query = f"{query}\n\n{prompt}"
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Context: {context}\n\nQuery: {query}\n\nReasoning Type: {reasoning_type}\n\nPlease provide a summary and details for this query, considering the given context if relevant."}
-            ]
-            chat_completion = client.chat.completions.create(
-                messages=messages,
-                model=model_id,
-                max_tokens=1000,
-            )
-            response = chat_completion.choices[0].message.content
-            summary, details = response.split("\n\n", 1) if "\n\n" in response else (response, "No detailed information available.")
-        return summary, details
+        with st.spinner(REASONING_SPINNERS[reasoning_type]):
+            context = document_text(file_name) if file_name in st.session_state.files else ""
+            if context:
+                context = get_retrieval_index(st.session_state.files[file_name], context).select(query, context_token_budget(model_id), context)
+            history = None
+            if remember:
+                tail = conversation_tail(name)
+                replaced = 2 if replace_last_turn and len(tail) >= 2 and tail[-1]["role"] == "assistant" else 0
+                history = memory.history_messages(conversation.setdefault("memory", memory.new_memory()), tail[:len(tail) - replaced])
+            summary, details = reasoning.run_query(client, query, model_id, conversation.get("system_prompt", ""), context, reasoning_type, selected_task,
+                                                   bypass_cache=bypass_cache, timings=timings, on_delta=show_delta, history=history, route=current_route())
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
-        return None, None
+        return
+    finally:
+        placeholder.empty()
+    if summary and details:
+        conversation["summary"] = summary
+        conversation["details"] = details
+        if remember:
+            turn = [{"role": "user", "content": query}, {"role": "assistant", "content": memory.assistant_message(summary, details, reasoning_type)}]
+            if replaced:
+                get_conversation_store().replace_last_messages(workspace, name, turn)
+                tail[-replaced:] = turn
+            else:
+                get_conversation_store().append_messages(workspace, name, turn)
+                tail.extend(turn)
+    if timings:
+        conversation["run_stats"] = reasoning.format_stage_timings(timings)
+
+# Logo bytes read once per process instead of on every rerun
+@st.cache_resource(show_spinner=False)
+def get_logo():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "p1.png"), "rb") as f:
+        return f.read()
 
 # Streamlit UI layout
 st.set_page_config(layout="wide", page_title="Enhanced Groq Search App")
-st.image("p1.png", width=160)
+st.image(get_logo(), width=160)
+
+# Route every completion through the shared response cache
+llm.set_response_cache(get_response_cache())
+# Every completion that reaches a model updates the router's rolling stats
+llm.set_call_observer(get_router().observe)
+
+# Conversations are saved per workspace (?workspace=id in the URL). A visit without one gets a new private
+# workspace whose id goes into the URL, so a reload or bookmark finds the same conversations
+if "workspace" not in st.session_state:
+    st.session_state.workspace = st.query_params.get("workspace") or uuid.uuid4().hex
+if st.query_params.get("workspace") != st.session_state.workspace:
+    st.query_params["workspace"] = st.session_state.workspace
+workspace = st.session_state.workspace
 
 # Initialize session state
 if "conversations" not in st.session_state:
-    st.session_state.conversations = {"2024-04-15 15:27:16": {"summary": "", "details": "", "system_prompt": "You are a helpful assistant that provides summaries and details based on user queries and given context."}}
+    st.session_state.conversations = get_conversation_store().load(workspace) or {"2024-04-15 15:27:16": {"summary": "", "details": "", "system_prompt": "You are a helpful assistant that provides summaries and details based on user queries and given context."}}
+    st.session_state.saved_conversations = {name: json.dumps(data, sort_keys=True) for name, data in st.session_state.conversations.items()}
 if "files" not in st.session_state:
     st.session_state.files = {}
+    st.session_state.processed_uploads = set()
+    # Uploads whose extraction skipped pages, by file id -> number of skipped pages
+    st.session_state.incomplete_uploads = {}
+    st.session_state.message_tails = {}
+    st.session_state.session_documents = SessionDocuments(get_document_store(), script_ctx.session_id if script_ctx else str(uuid.uuid4()))
 if "selected_model" not in st.session_state:
     st.session_state.selected_model = "Mixtral 8x7B"
 if "active_conversation" not in st.session_state:
-    st.session_state.active_conversation = "2024-04-15 15:27:16"
+    st.session_state.active_conversation = next(iter(st.session_state.conversations))
 if "reasoning_type" not in st.session_state:
     st.session_state.reasoning_type = "Single-path"
 if "selected_task" not in st.session_state:
     st.session_state.selected_task = "Research and Information Retrieval"
+if "routing_preference" not in st.session_state:
+    st.session_state.routing_preference = "Quality"
+    st.session_state.speculative_routing = False
+
+# Persist the conversations this session changed since its last save; deletes and renames are written when they happen
+def save_conversations():
+    snapshots = {name: json.dumps(data, sort_keys=True) for name, data in st.session_state.conversations.items()}
+    changed = {name: st.session_state.conversations[name] for name, snapshot in snapshots.items()
+               if st.session_state.saved_conversations.get(name) != snapshot}
+    if changed:
+        get_conversation_store().save(workspace, changed)
+    st.session_state.saved_conversations = snapshots
+
+# Fold the oldest turns of the active conversation into its rolling summary once they pass the history budget
+def compact_memory():
+    name = st.session_state.active_conversation
+    tail = conversation_tail(name)
+    if not memory.needs_compaction(tail):
+        return
+    conversation_memory = st.session_state.conversations[name].setdefault("memory", memory.new_memory())
+    try:
+        with st.spinner("Summarizing earlier turns..."):
+            st.session_state.message_tails[name] = memory.compact(client, SUPPORTED_MODELS[st.session_state.selected_model], conversation_memory, tail, route=current_route())
+    except Exception as e:
+        # The tail keeps growing until a later turn manages to compact it; history_messages still caps the prompt
+        st.warning(f"Could not summarize earlier turns: {str(e)}")
+
+# Span for one run of a fragment: nested in the app rerun, or its own trace when only the fragment reruns
+def fragment_span_for(fragment):
+    return tracing.start_span("streamlit.fragment", root=tracing.current_span() is not rerun_span, fragment=fragment,
+                              session=script_ctx.session_id if script_ctx else None)
+
+# Sidebar file index; picking a file or generating a report reruns only this fragment
+@st.fragment
+def file_index():
+    with fragment_span_for("file_index") as fragment_span:
+        st.header("File Index")
+        selected_file = st.selectbox("Select a file", list(st.session_state.files.keys()), key="selected_file")
+        if st.button("Generate Report") and selected_file:
+            model_id = SUPPORTED_MODELS[st.session_state.selected_model]
+            reasoning_type = st.session_state.reasoning_type
+            document = document_text(selected_file)
+            # document_text has already warned that the file is gone; keep the current summary
+            if selected_file not in st.session_state.files:
+                return
+
+            conversation = st.session_state.conversations[st.session_state.active_conversation]
+            conversation.pop("run_stats", None)
+            timings = {}
+            placeholder = st.empty()
+            with st.spinner("Generating report..."):
+                try:
+                    report_summary, report_details, report_stats = report.generate_report(
+                        client, document, selected_file, model_id, conversation.get("system_prompt", ""), reasoning_type,
+                        st.session_state.selected_task if reasoning_type == "Multi-path" else None,
+                        text_tokens=count_document_tokens(st.session_state.files[selected_file], document),
+                        index=get_retrieval_index(st.session_state.files[selected_file], document), timings=timings, on_delta=stage_stream_display(placeholder), route=current_route())
+                    if report_stats:
+                        conversation["run_stats"] = report.format_report_stats(report_stats)
+                    elif timings:
+                        conversation["run_stats"] = reasoning.format_stage_timings(timings)
+                except Exception as e:
+                    st.error(f"An error occurred: {str(e)}")
+                    report_summary, report_details = None, None
+                finally:
+                    placeholder.empty()
+                if report_summary and report_details:
+                    conversation["summary"] = report_summary
+                    conversation["details"] = report_details
+                else:
+                    conversation["summary"] = "Failed to generate report."
+                    conversation["details"] = "An error occurred during report generation."
+
+            # A full rerun, so the chat panel shows the report
+            fragment_span.end()
+            rerun_span.end()
+            st.rerun()
+
+# Chat input, response and details; Send and Regenerate rerun only this fragment
+@st.fragment
+def chat_panel():
+    with fragment_span_for("chat_panel"):
+        col1, col2 = st.columns([1, 2])
+
+        with col1:
+            st.subheader("Chat Input")
+            user_input = st.text_input("Enter your query here...")
+            if st.button("Send"):
+                if user_input:
+                    answer_query(user_input, st.session_state.get("selected_file"))
+                else:
+                    st.warning("Please enter a query to search.")
+
+            if st.button("Regenerate"):
+                if st.session_state.conversations[st.session_state.active_conversation]["summary"]:
+                    answer_query(user_input, st.session_state.get("selected_file"), bypass_cache=True, replace_last_turn=True)
+
+            st.text_area("Response", value=st.session_state.conversations[st.session_state.active_conversation].get("summary", ""), height=200, key="response_area")
+
+            # Display the editable system prompt below the response box
+            st.session_state.conversations[st.session_state.active_conversation]["system_prompt"] = st.text_area("System Prompt", value=st.session_state.conversations[st.session_state.active_conversation].get("system_prompt", ""), height=100, key="system_prompt_area")
+
+        with col2:
+            st.subheader("Information Panel")
+            st.text_area("Details", value=st.session_state.conversations[st.session_state.active_conversation].get("details", ""), height=600, key="details_area")
+            if st.session_state.conversations[st.session_state.active_conversation].get("run_stats"):
+                st.caption(st.session_state.conversations[st.session_state.active_conversation]["run_stats"])
+        # Fold older turns into the rolling summary after the answer is on screen, so the next turn stays small
+        compact_memory()
+        save_conversations()
 
 # Sidebar for model selection, conversations, reasoning type, and file management
 with st.sidebar:
     st.header("Model Selection")
     st.session_state.selected_model = st.selectbox("Select a model", list(SUPPORTED_MODELS.keys()))
+    cache_stats = get_response_cache().stats()
+    st.caption(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
 
     st.header("Conversations")
     selected_conversation = st.selectbox("Select a conversation", list(st.session_state.conversations.keys()), index=list(st.session_state.conversations.keys()).index(st.session_state.active_conversation))
@@ -227,6 +359,9 @@ with st.sidebar:
     if st.button("Delete Conversation"):
         if len(st.session_state.conversations) > 1:
             del st.session_state.conversations[selected_conversation]
+            get_conversation_store().delete(workspace, selected_conversation)
+            st.session_state.saved_conversations.pop(selected_conversation, None)
+            st.session_state.message_tails.pop(selected_conversation, None)
             st.session_state.active_conversation = list(st.session_state.conversations.keys())[0]
             st.rerun()
         else:
@@ -235,143 +370,96 @@ with st.sidebar:
     new_name = st.text_input("Rename", value=selected_conversation)
     if new_name and new_name != selected_conversation:
         st.session_state.conversations[new_name] = st.session_state.conversations.pop(selected_conversation)
+        get_conversation_store().rename(workspace, selected_conversation, new_name)
+        st.session_state.saved_conversations.pop(new_name, None)
+        if selected_conversation in st.session_state.saved_conversations:
+            st.session_state.saved_conversations[new_name] = st.session_state.saved_conversations.pop(selected_conversation)
+        st.session_state.message_tails.pop(new_name, None)
+        if selected_conversation in st.session_state.message_tails:
+            st.session_state.message_tails[new_name] = st.session_state.message_tails.pop(selected_conversation)
         st.session_state.active_conversation = new_name
         st.rerun()
 
     st.header("Advanced Prompt Reasoning")
     st.session_state.reasoning_type = st.radio(
         "Select Reasoning Type",
-        ("Single-path", "Multi-path", "Advance Steps", "Enhanced System Prompt")
+        reasoning.REASONING_TYPES
     )
     
     if st.session_state.reasoning_type == "Multi-path":
         st.session_state.selected_task = st.selectbox(
             "Select Task Type",
-            ("Research and Information Retrieval", "Code Debugging", "Content Generation", "Strategic Planning")
+            reasoning.TASK_TYPES
         )
+
+    # Quality keeps every stage on the selected model; Balanced moves prompt rewriting and summarizing
+    # stages to faster models; Speed also lets the answering stages use mid-sized models
+    st.session_state.routing_preference = st.select_slider("Model routing", ROUTING_PREFERENCES, value=st.session_state.routing_preference)
+    st.session_state.speculative_routing = st.checkbox("Race routed stages against the selected model", value=st.session_state.speculative_routing)
+    routing_stats = get_router().summary()
+    if routing_stats["decisions"]:
+        st.caption(f"Routing: {routing_stats['routed']}/{routing_stats['decisions']} calls routed, {routing_stats['races']} races, "
+                   f"about {routing_stats['saved_seconds']}s saved")
     
     st.header("File Upload")
     uploaded_file = st.file_uploader("Choose a file", type=["txt", "pdf", "docx"])
     if uploaded_file is not None:
-        file_contents = uploaded_file.read()
-        text_content = extract_text_from_file(file_contents, uploaded_file.name)
-        st.session_state.files[uploaded_file.name] = text_content
-        st.success(f"File {uploaded_file.name} uploaded and processed successfully!")
-    
-    st.header("File Index")
-    selected_file = st.selectbox("Select a file", list(st.session_state.files.keys()))
-    if st.button("Generate Report") and selected_file:
-        context = st.session_state.files[selected_file]
-        model_id = SUPPORTED_MODELS[st.session_state.selected_model]
-        reasoning_type = st.session_state.reasoning_type
-        selected_task = st.session_state.selected_task if reasoning_type == "Multi-path" else None
-        system_prompt = st.session_state.conversations[st.session_state.active_conversation].get("system_prompt", "")
-
-        if reasoning_type == "Advance Steps":
-            with st.spinner("Executing advanced steps..."):
-                improved_prompt, generated_response, review_feedback, analysis_summary = advanced_steps(context, model_id)
-                st.session_state.conversations[st.session_state.active_conversation]["summary"] = analysis_summary
-                st.session_state.conversations[st.session_state.active_conversation]["details"] = f"Improved Prompt:\n{improved_prompt}\n\nGenerated Response:\n{generated_response}\n\nReview Feedback:\n{review_feedback}"
-        elif reasoning_type == "Enhanced System Prompt":
-            with st.spinner("Generating enhanced prompt response..."):
-                system_prompt = enhanced_system_prompt(context)
-                response = client.chat.completions.create(
-                    messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": context}],
-                    model=model_id,
-                    max_tokens=1000,
-                )
-                generated_response = response.choices[0].message.content
-                st.session_state.conversations[st.session_state.active_conversation]["summary"] = generated_response
+        # Each upload is processed once per session; later reruns only show the confirmation
+        if uploaded_file.file_id not in st.session_state.processed_uploads:
+            file_contents = uploaded_file.read()
+            progress = st.progress(0.0, text=f"Extracting {uploaded_file.name}...")
+            preview = st.empty()
 
-        else:
-            with st.spinner("Generating report..."):
-                report_summary, report_details = search_and_summarize(f"Generate a detailed report for the file: {selected_file}", model_id, system_prompt, context, reasoning_type, selected_task)
-                if report_summary and report_details:
-                    st.session_state.conversations[st.session_state.active_conversation]["summary"] = report_summary
-                    st.session_state.conversations[st.session_state.active_conversation]["details"] = report_details
-                else:
-                    st.session_state.conversations[st.session_state.active_conversation]["summary"] = "Failed to generate report."
-                    st.session_state.conversations[st.session_state.active_conversation]["details"] = "An error occurred during report generation."
+            def show_extraction_progress(page_number, page_count, text):
+                progress.progress(page_number / page_count, text=f"Extracting {uploaded_file.name}: {page_number}/{page_count}")
+                preview.caption(text[-300:])
 
-        st.rerun()
-
-# Main panel for displaying the search input and results
-col1, col2 = st.columns([1, 2])
-
-with col1:
-    st.subheader("Chat Input")
-    user_input = st.text_input("Enter your query here...")
-    if st.button("Send"):
-        if user_input:
-            context = st.session_state.files.get(selected_file, "") if selected_file else ""
-            model_id = SUPPORTED_MODELS[st.session_state.selected_model]
-            reasoning_type = st.session_state.reasoning_type
-            selected_task = st.session_state.selected_task if reasoning_type == "Multi-path" else None
-            system_prompt = st.session_state.conversations[st.session_state.active_conversation].get("system_prompt", "")
-            
-            if reasoning_type == "Advance Steps":
-                with st.spinner("Executing advanced steps..."):
-                    improved_prompt, generated_response, review_feedback, analysis_summary = advanced_steps(user_input, model_id)
-                    st.session_state.conversations[st.session_state.active_conversation]["summary"] = analysis_summary
-                    st.session_state.conversations[st.session_state.active_conversation]["details"] = f"Improved Prompt:\n{improved_prompt}\n\nGenerated Response:\n{generated_response}\n\nReview Feedback:\n{review_feedback}"
-            elif reasoning_type == "Enhanced System Prompt":
-                with st.spinner("Generating enhanced prompt response..."):
-                    system_prompt = enhanced_system_prompt(user_input)
-                    response = client.chat.completions.create(
-                        messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_input}],
-                        model=model_id,
-                        max_tokens=1000,
-                    )
-                    generated_response = response.choices[0].message.content
-                    st.session_state.conversations[st.session_state.active_conversation]["summary"] = generated_response
-                    st.session_state.conversations[st.session_state.active_conversation]["details"] = generated_response
-            else:
-                summary, details = search_and_summarize(user_input, model_id, system_prompt, context, reasoning_type, selected_task)
-                if summary and details:
-                    st.session_state.conversations[st.session_state.active_conversation]["summary"] = summary
-                    st.session_state.conversations[st.session_state.active_conversation]["details"] = details
+            text_content = get_extraction_cache().get_or_extract(file_contents, uploaded_file.name, on_page=show_extraction_progress)
+            progress.empty()
+            preview.empty()
+            document_store = get_document_store()
+            session_id = st.session_state.session_documents.session_id
+            doc_hash = document_store.put(text_content, session_id)
+            get_retrieval_index(doc_hash, text_content)
+            # Re-uploading a name with new content drops the old text unless another name still uses it
+            previous_hash = st.session_state.files.get(uploaded_file.name)
+            st.session_state.files[uploaded_file.name] = doc_hash
+            if previous_hash and previous_hash not in st.session_state.files.values():
+                document_store.release(session_id, previous_hash)
+            st.session_state.processed_uploads.add(uploaded_file.file_id)
+            if isinstance(text_content, IncompleteText):
+                st.session_state.incomplete_uploads[uploaded_file.file_id] = text_content.skipped_pages
+        skipped_pages = st.session_state.incomplete_uploads.get(uploaded_file.file_id)
+        if skipped_pages:
+            # Incomplete text is not cached, so a retry extracts the file again
+            st.warning(f"{skipped_pages} page(s) of {uploaded_file.name} could not be extracted.")
+            if st.button("Retry extraction"):
+                st.session_state.processed_uploads.discard(uploaded_file.file_id)
+                del st.session_state.incomplete_uploads[uploaded_file.file_id]
+                st.rerun()
         else:
-            st.warning("Please enter a query to search.")
-
-    if st.button("Regenerate"):
-        if st.session_state.conversations[st.session_state.active_conversation]["summary"]:
-            context = st.session_state.files.get(selected_file, "") if selected_file else ""
-            model_id = SUPPORTED_MODELS[st.session_state.selected_model]
-            reasoning_type = st.session_state.reasoning_type
-            selected_task = st.session_state.selected_task if reasoning_type == "Multi-path" else None
-            system_prompt = st.session_state.conversations[st.session_state.active_conversation].get("system_prompt", "")
-
-            if reasoning_type == "Advance Steps":
-                with st.spinner("Executing advanced steps..."):
-                    improved_prompt, generated_response, review_feedback, analysis_summary = advanced_steps(user_input, model_id)
-                    st.session_state.conversations[st.session_state.active_conversation]["summary"] = analysis_summary
-                    st.session_state.conversations[st.session_state.active_conversation]["details"] = f"Improved Prompt:\n{improved_prompt}\n\nGenerated Response:\n{generated_response}\n\nReview Feedback:\n{review_feedback}"
-            elif reasoning_type == "Enhanced System Prompt":
-                with st.spinner("Generating enhanced prompt response..."):
-                    system_prompt = enhanced_system_prompt(user_input)
-                    response = client.chat.completions.create(
-                        messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_input}],
-                        model=model_id,
-                        max_tokens=1000,
-                    )
-                    generated_response = response.choices[0].message.content
-                    st.session_state.conversations[st.session_state.active_conversation]["summary"] = generated_response
-                    st.session_state.conversations[st.session_state.active_conversation]["details"] = generated_response
-            else:
-                summary, details = search_and_summarize(user_input, model_id, system_prompt, context, reasoning_type, selected_task)
-                if summary and details:
-                    st.session_state.conversations[st.session_state.active_conversation]["summary"] = summary
-                    st.session_state.conversations[st.session_state.active_conversation]["details"] = details
+            st.success(f"File {uploaded_file.name} uploaded and processed successfully!")
+    
+    file_index()
 
-    st.text_area("Response", value=st.session_state.conversations[st.session_state.active_conversation].get("summary", ""), height=200, key="response_area")
+    if get_tracer() is not None:
+        with st.expander("Tracing"):
+            # Spans of this session's latest runs that did more than render
+            traces = [trace for trace in get_tracer().recent_traces(20, session=script_ctx.session_id if script_ctx else None) if len(trace[1]) > 1][:3]
+            for root, ordered in traces:
+                st.code(tracing.format_trace(ordered), language=None)
+            if not traces:
+                st.caption("No traced requests yet.")
+            st.caption("Latency percentiles (ms), all sessions")
+            st.dataframe(get_tracer().histogram_rows(), hide_index=True)
 
-    # Display the editable system prompt below the response box
-    st.session_state.conversations[st.session_state.active_conversation]["system_prompt"] = st.text_area("System Prompt", value=st.session_state.conversations[st.session_state.active_conversation].get("system_prompt", ""), height=100, key="system_prompt_area")
+# Main panel for displaying the search input and results
+chat_panel()
 
-with col2:
-    st.subheader("Information Panel")
-    st.text_area("Details", value=st.session_state.conversations[st.session_state.active_conversation].get("details", ""), height=600, key="details_area")
+save_conversations()
 
 # Footer with additional options
 st.markdown("<div style='text-align: center; color: grey;'>Powered by Groq</div>", unsafe_allow_html=True)
-st.info("build by dw 9-12-24")
\ No newline at end of file
+st.info("build by dw 9-12-24")
+
+rerun_span.end()
\ No newline at end of file
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import tracing
+from tokens import count_message_tokens, count_tokens
+
+# Every chat completion in the app goes through chat() or stream_chat() so responses can be cached in one place.
+
+_response_cache = None
+
+
+# Install the process-wide response cache (None turns caching off)
+def set_response_cache(cache):
+    global _response_cache
+    _response_cache = cache
+
+
+def get_response_cache():
+    return _response_cache
+
+
+_call_observer = None
+
+
+# Install a callback seeing every completion that reached the model (not cache hits) as
+# observer(model_id, seconds, first_token_seconds or None, completion_tokens); None removes it
+def set_call_observer(observer):
+    global _call_observer
+    _call_observer = observer
+
+
+# Exact-match key over everything that determines the completion
+def cache_key(model_id, messages, max_tokens, **sampling):
+    payload = json.dumps({"model": model_id, "messages": messages, "max_tokens": max_tokens, "sampling": sampling},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# LRU of recent responses in memory, backed by SQLite so entries survive restarts; both expire after ttl seconds
+class ResponseCache:
+    def __init__(self, db_path, max_entries=512, ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - ttl,))
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                entry = (row[1], row[0]) if row else None
+            if entry is None or entry[0] < now - self.ttl:
+                self._memory.pop(key, None)
+                self.misses += 1
+                return None
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._memory[key] = (now, response)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+            self._db.execute("INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)", (key, response, now))
+            # Expired rows go as new ones arrive, so a long-running process does not grow the file without bound
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+# Add the token usage of a chat completion to a running {"prompt_tokens", "completion_tokens"} tally
+def add_usage(usage, chat_completion):
+    reported = getattr(chat_completion, "usage", None)
+    usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + (getattr(reported, "prompt_tokens", 0) or 0)
+    usage["completion_tokens"] = usage.get("completion_tokens", 0) + (getattr(reported, "completion_tokens", 0) or 0)
+
+
+# Return the text of one chat completion, from the cache unless bypass_cache is set.
+# A bypassed call still stores its fresh response, so the next identical request sees it.
+def chat(client, model_id, messages, max_tokens, bypass_cache=False, usage=None, **sampling):
+    with tracing.span("llm.chat", model=model_id, stream=False, max_tokens=max_tokens) as span:
+        cache = _response_cache
+        key = cache_key(model_id, messages, max_tokens, **sampling) if cache else None
+        if cache and not bypass_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                span.set(cached=True)
+                return cached
+        started = time.perf_counter()
+        chat_completion = client.chat.completions.create(
+            messages=messages,
+            model=model_id,
+            max_tokens=max_tokens,
+            **sampling,
+        )
+        if usage is not None:
+            add_usage(usage, chat_completion)
+        observer = _call_observer
+        if observer:
+            reported = getattr(chat_completion, "usage", None)
+            completion_tokens = getattr(reported, "completion_tokens", None) or count_tokens(chat_completion.choices[0].message.content or "")
+            observer(model_id, time.perf_counter() - started, None, completion_tokens)
+        if span.recording:
+            reported = getattr(chat_completion, "usage", None)
+            span.set(cached=False, prompt_tokens=getattr(reported, "prompt_tokens", None), completion_tokens=getattr(reported, "completion_tokens", None))
+        response = chat_completion.choices[0].message.content
+        if cache:
+            cache.put(key, response)
+        return response
+
+
+# Stream the text of one chat completion as deltas; a cache hit arrives as a single delta.
+# Only a stream that ran to completion is cached. `cancelled` is passed on to a ResilientGroq client, which
+# checks it before sending so a request abandoned while it queued never goes out.
+def stream_chat(client, model_id, messages, max_tokens, bypass_cache=False, cancelled=None, **sampling):
+    # The span is only made current around create(): a generator runs in its caller's context
+    span = tracing.start_span("llm.chat", activate=False, model=model_id, stream=True, max_tokens=max_tokens)
+    error = None
+    first_token = None
+    parts = []
+    try:
+        cache = _response_cache
+        key = cache_key(model_id, messages, max_tokens, **sampling) if cache else None
+        if cache and not bypass_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                span.set(cached=True)
+                yield cached
+                return
+        started = time.perf_counter()
+        with tracing.use_span(span):
+            stream = client.chat.completions.create(
+                messages=messages,
+                model=model_id,
+                max_tokens=max_tokens,
+                stream=True,
+                **({"cancelled": cancelled} if cancelled is not None else {}),
+                **sampling,
+            )
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if not parts:
+                    first_token = time.perf_counter() - started
+                    span.set(time_to_first_token=first_token)
+                parts.append(delta)
+                yield delta
+        if span.recording:
+            # Streamed chunks carry no usage, so these are local estimates
+            span.set(cached=False, prompt_tokens=count_message_tokens(messages), completion_tokens=count_tokens("".join(parts)), tokens_estimated=True)
+        observer = _call_observer
+        if observer:
+            observer(model_id, time.perf_counter() - started, first_token, count_tokens("".join(parts)))
+        if cache:
+            cache.put(key, "".join(parts))
+    except GeneratorExit:
+        span.set(closed_early=True)
+        # A stream closed after its first token (e.g. the loser of a routing race) still measured the model
+        observer = _call_observer
+        if observer and first_token is not None:
+            observer(model_id, time.perf_counter() - started, first_token, count_tokens("".join(parts)))
+        raise
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end(error=error)
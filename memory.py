@@ -0,0 +1,79 @@
+import llm
+from tokens import count_message_tokens, fit_text
+
+# Multi-turn memory for a conversation: every message is appended to a log (see ConversationStore), and
+# the prompt carries a rolling summary of older turns plus the turns since, verbatim.
+# Once the verbatim tail passes HISTORY_TOKEN_BUDGET its oldest turns are folded into the summary with
+# one request over (previous summary + folded turns), so a turn never re-sends the whole transcript.
+
+# Tokens of verbatim recent messages kept before the oldest are folded into the summary
+HISTORY_TOKEN_BUDGET = 1500
+# Messages always kept verbatim (the last question and answer)
+KEEP_RECENT_MESSAGES = 2
+SUMMARY_MAX_TOKENS = 400
+
+SUMMARY_SYSTEM_PROMPT = ("You maintain a running summary of a conversation between a user and an assistant. "
+                         "Keep every fact, decision, name and open question needed to answer follow-up questions; drop pleasantries.")
+
+
+# Memory state stored with the conversation: the rolling summary and how many log messages it covers
+def new_memory():
+    return {"summary": "", "summarized": 0}
+
+
+def transcript(messages):
+    return "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+
+
+# Messages to place before the new query: the summary as a system message, then as much of the
+# verbatim tail as fits the budget (newest first, so an oversized old message cannot crowd out the last turn)
+def history_messages(memory, tail, budget=HISTORY_TOKEN_BUDGET):
+    recent, used = [], 0
+    for message in reversed(tail):
+        tokens = count_message_tokens([message])
+        if used + tokens > budget:
+            # The newest message is always kept, cut down to the budget if need be
+            if not recent:
+                recent.append({"role": message["role"], "content": fit_text(message["content"], budget)})
+            break
+        recent.append({"role": message["role"], "content": message["content"]})
+        used += tokens
+    history = list(reversed(recent))
+    if memory["summary"]:
+        history.insert(0, {"role": "system", "content": f"Summary of the earlier conversation:\n{memory['summary']}"})
+    return history
+
+
+# The assistant message logged for an answer; Advance Steps details hold the whole chain, so only the summary is kept
+def assistant_message(summary, details, reasoning_type):
+    if reasoning_type == "Advance Steps" or not details or details == summary:
+        return summary
+    return f"{summary}\n\n{details}"
+
+
+def needs_compaction(tail, budget=HISTORY_TOKEN_BUDGET):
+    return len(tail) > KEEP_RECENT_MESSAGES and count_message_tokens(tail) > budget
+
+
+# Fold the oldest messages of the tail into the summary until the rest fits half the budget.
+# Updates memory in place and returns the remaining tail. The request goes through llm.chat, so an
+# identical fold (e.g. the same conversation reopened elsewhere) is answered from the response cache.
+# With a route (router.RoutePolicy) the fold runs as the "summarize" stage, usually on a small model.
+def compact(client, model_id, memory, tail, budget=HISTORY_TOKEN_BUDGET, route=None):
+    fold = 0
+    while fold < len(tail) - KEEP_RECENT_MESSAGES and count_message_tokens(tail[fold:]) > budget // 2:
+        fold += 1
+    if not fold:
+        return tail
+    folded = tail[:fold]
+    messages = [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Current summary:\n{memory['summary'] or '(none yet)'}\n\nNew messages:\n"
+                                    f"{fit_text(transcript(folded), budget)}\n\nRewrite the summary to include the new messages."},
+    ]
+    if route:
+        memory["summary"] = route.chat(client, "summarize", model_id, messages, SUMMARY_MAX_TOKENS)
+    else:
+        memory["summary"] = llm.chat(client, model_id, messages, SUMMARY_MAX_TOKENS)
+    memory["summarized"] += fold
+    return tail[fold:]
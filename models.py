@@ -0,0 +1,45 @@
+# Supported models
+SUPPORTED_MODELS = {
+    "Llama 3 70B": "llama3-70b-8192",
+    "Llama 3 8B": "llama3-8b-8192",
+    "Llama 3.1 70B": "llama-3.1-70b-versatile",
+    "Llama 3.1 8B": "llama-3.1-8b-instant",
+    "Mixtral 8x7B": "mixtral-8x7b-32768",
+    "Gemma 2 9B": "gemma2-9b-it"
+}
+
+# Context window (in tokens) of each model id in SUPPORTED_MODELS
+MODEL_CONTEXT_WINDOWS = {
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "llama-3.1-70b-versatile": 131072,
+    "llama-3.1-8b-instant": 131072,
+    "mixtral-8x7b-32768": 32768,
+    "gemma2-9b-it": 8192,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Relative answer quality (higher is better), used by the router to decide which stages a model may take
+MODEL_QUALITY = {
+    "llama3-70b-8192": 3,
+    "llama-3.1-70b-versatile": 3,
+    "mixtral-8x7b-32768": 2,
+    "gemma2-9b-it": 1,
+    "llama3-8b-8192": 1,
+    "llama-3.1-8b-instant": 1,
+}
+
+# Starting guesses of (seconds to first token, output tokens per second) until the router has measured a model
+MODEL_SPEED_PRIORS = {
+    "llama3-70b-8192": (0.35, 280.0),
+    "llama-3.1-70b-versatile": (0.35, 250.0),
+    "mixtral-8x7b-32768": (0.3, 480.0),
+    "gemma2-9b-it": (0.25, 500.0),
+    "llama3-8b-8192": (0.2, 800.0),
+    "llama-3.1-8b-instant": (0.2, 750.0),
+}
+
+
+# Accept either a display name from SUPPORTED_MODELS or a model id
+def resolve_model(name_or_id):
+    return SUPPORTED_MODELS.get(name_or_id, name_or_id)
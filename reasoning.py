@@ -0,0 +1,224 @@
+import time
+
+import llm
+import tracing
+from memory import transcript
+from tokens import MESSAGE_OVERHEAD_TOKENS, completion_budget, count_message_tokens, count_tokens, fit_text, section_budget
+
+# Prompt templates and request logic shared by the Streamlit app and the report pipeline.
+# Everything here takes the Groq client as an argument and leaves spinners and error display to the caller.
+
+# The four advanced steps: (stage, system prompt, user prompt template, max_tokens).
+# Each stage's template is filled with the full output of the stage before it.
+ADVANCED_STEPS = (
+    ("improve", "You are an expert at refining prompts.", "Please improve the following prompt for optimal results:\n{}", 500),
+    ("respond", None, "{}", 1000),
+    ("review", "You are an expert reviewer and grader.", "Please review and grade the following response:\n{}", 500),
+    ("analyze", "You are an expert in summarizing and analyzing feedback.", "Please analyze and summarize the following review feedback:\n{}", 500),
+)
+ADVANCED_STAGES = tuple(stage for stage, _, _, _ in ADVANCED_STEPS)
+
+REASONING_TYPES = ("Single-path", "Multi-path", "Advance Steps", "Enhanced System Prompt")
+TASK_TYPES = ("Research and Information Retrieval", "Code Debugging", "Content Generation", "Strategic Planning")
+
+
+# Enhanced System Prompt Logic
+def enhanced_system_prompt(query):
+    prompt = f"""
+    <thinking>
+    1. Begin analyzing the question: "{query}"
+    2. Plan of action:
+        a. Briefly outline the approach.
+        b. Present a step-by-step reasoning process.
+        c. Use "Chain of Thought" reasoning if needed, breaking it into steps.
+        d. Consider alternative solutions if applicable.
+    </thinking>
+
+    <reflection>
+    1. Review reasoning.
+    2. Check for potential errors, optimizations, or enhancements.
+    3. Reflect on alternative approaches, if any.
+    </reflection>
+
+    <output>
+    Provide final answer based on the above reasoning and reflection.
+    </output>
+    """
+    return prompt
+
+
+# Function to handle multi-path reasoning using the ReAct framework
+def multi_path_reasoning(selected_task):
+    if selected_task == "Research and Information Retrieval":
+        return """
+        Thought 1: I need to gather detailed information about the impact of climate change on coastal cities. 
+        Act 1: Search["impact of climate change on coastal cities"] 
+        Obs 1: The search results include scientific articles, government reports, and case studies on the impact of rising sea levels on coastal cities.
+        Thought 2: The information seems scattered. I need to focus on retrieving case studies from government reports.
+        Act 2: Search["case studies from government reports on rising sea levels"] 
+        Obs 2: Found multiple case studies from NOAA and the EPA detailing the impact on specific cities. 
+        Thought 3: I have enough case studies but need to summarize key points.
+        Act 3: Summarize["key points from case studies on rising sea levels"] 
+        Act 4: Finish[summary of key points]
+        """
+    elif selected_task == "Code Debugging":
+        return """
+        Thought 1: I need to debug a Python script that’s throwing a TypeError.
+        Act 1: Review["Python script TypeError"] 
+        Obs 1: The TypeError is due to a mismatch in data types when calling a function.
+        Thought 2: I should identify the exact line causing the error and check the data types involved.
+        Act 2: Inspect["line of code causing TypeError and data types"] 
+        Obs 2: The error is occurring because an integer is being passed where a string is expected.
+        Thought 3: I need to correct the data type mismatch and rerun the script.
+        Act 3: Modify["correct data type from integer to string"] 
+        Act 4: Finish[rerun the script]
+        """
+    elif selected_task == "Content Generation":
+        return """
+        Thought 1: I need to write a blog post on the benefits of AI in healthcare.
+        Act 1: Generate["outline for blog post on AI in healthcare"] 
+        Obs 1: The outline includes sections on diagnostic tools, personalized medicine, and operational efficiency.
+        Thought 2: I should expand the section on personalized medicine with examples.
+        Act 2: Research["examples of personalized medicine using AI"] 
+        Obs 2: Found examples of AI-driven treatments for cancer and diabetes.
+        Thought 3: I can now draft the personalized medicine section with these examples.
+        Act 3: Write["draft section on personalized medicine with AI examples"] 
+        Act 4: Finish[draft complete]
+        """
+    elif selected_task == "Strategic Planning":
+        return """
+        Thought 1: I need to develop a strategic plan for increasing customer retention.
+        Act 1: Identify["key factors affecting customer retention"] 
+        Obs 1: Key factors include product satisfaction, customer support quality, and engagement strategies.
+        Thought 2: I should focus on improving customer support and engagement strategies.
+        Act 2: Develop["action plan for improving customer support and engagement"] 
+        Obs 2: Created a plan including personalized communication, regular feedback loops, and loyalty programs.
+        Thought 3: I need to present this plan to the executive team.
+        Act 3: Prepare["presentation for executive team on customer retention strategies"] 
+        Act 4: Finish[presentation ready]
+        """
+    return ""
+
+
+# Messages and reply budget for search_and_summarize, with the context cut to what the model window leaves
+def search_messages(query, model_id, system_prompt, context="", reasoning_type="Single-path", selected_task=None, max_tokens=1000, history=None):
+    if reasoning_type == "Multi-path" and selected_task:
+        prompt = multi_path_reasoning(selected_task)
+        query = f"{query}\n\n{prompt}"
+
+    def build_messages(context):
+        return [
+            {"role": "system", "content": system_prompt},
+            *(history or ()),
+            {"role": "user", "content": f"Context: {context}\n\nQuery: {query}\n\nReasoning Type: {reasoning_type}\n\nPlease provide a summary and details for this query, considering the given context if relevant."}
+        ]
+
+    # The context gets whatever the rest of the prompt and the reply leave of the model window
+    context = fit_text(context, section_budget(model_id, count_message_tokens(build_messages("")), max_tokens))
+    messages = build_messages(context)
+    return messages, completion_budget(model_id, count_message_tokens(messages), max_tokens)
+
+
+# Function to search and summarize using Groq API
+# history, if given, is a list of earlier messages (see memory.history_messages) placed before the query
+def search_and_summarize(client, query, model_id, system_prompt, context="", reasoning_type="Single-path", selected_task=None, max_tokens=1000, usage=None, bypass_cache=False,
+                         history=None):
+    messages, max_tokens = search_messages(query, model_id, system_prompt, context, reasoning_type, selected_task, max_tokens, history)
+    response = llm.chat(client, model_id, messages, max_tokens, bypass_cache=bypass_cache, usage=usage)
+    summary, details = response.split("\n\n", 1) if "\n\n" in response else (response, "No detailed information available.")
+    return summary, details
+
+
+# Messages and reply budget for enhanced_prompt_response
+def enhanced_messages(query, model_id, max_tokens=1000, history=None):
+    history = list(history or ())
+    # The query appears twice (inside the scaffold and as the user turn), so each copy gets half the room
+    scaffold_tokens = count_message_tokens([{"role": "system", "content": enhanced_system_prompt("")}, *history, {"role": "user", "content": ""}])
+    query = fit_text(query, section_budget(model_id, scaffold_tokens, max_tokens) // 2)
+    messages = [{"role": "system", "content": enhanced_system_prompt(query)}, *history, {"role": "user", "content": query}]
+    return messages, completion_budget(model_id, count_message_tokens(messages), max_tokens)
+
+
+# Answer a query under the enhanced (thinking / reflection / output) system prompt
+def enhanced_prompt_response(client, query, model_id, max_tokens=1000, usage=None, bypass_cache=False, history=None):
+    messages, max_tokens = enhanced_messages(query, model_id, max_tokens, history)
+    return llm.chat(client, model_id, messages, max_tokens, bypass_cache=bypass_cache, usage=usage)
+
+
+# Messages and reply budget for one ADVANCED_STEPS stage fed stage_input
+def advanced_stage_messages(stage_input, model_id, system_prompt, template, max_tokens):
+    fixed_tokens = count_tokens(system_prompt) + count_tokens(template.format("")) + 2 * MESSAGE_OVERHEAD_TOKENS
+    stage_input = fit_text(stage_input, section_budget(model_id, fixed_tokens, max_tokens))
+    messages = [{"role": "user", "content": template.format(stage_input)}]
+    if system_prompt:
+        messages.insert(0, {"role": "system", "content": system_prompt})
+    return messages, completion_budget(model_id, count_message_tokens(messages), max_tokens)
+
+
+# Stream the advanced steps chain as (stage, text delta) events.
+# Each stage is requested with stream=True the moment the previous stage's output is complete,
+# so the first tokens arrive after one round trip instead of four.
+# If timings is a dict it receives {stage: {"start", "first_token", "end"}} in seconds since the chain started.
+# With a route (router.RoutePolicy) each stage may run on another model than model_id.
+def iter_advanced_steps(client, query, model_id, timings=None, bypass_cache=False, route=None):
+    chain_started = time.perf_counter()
+    stage_input = query
+    for stage, system_prompt, template, max_tokens in ADVANCED_STEPS:
+        messages, max_tokens = advanced_stage_messages(stage_input, model_id, system_prompt, template, max_tokens)
+        stage_timing = {"start": round(time.perf_counter() - chain_started, 3), "first_token": None}
+        parts = []
+        if route:
+            deltas = route.stream_chat(client, stage, model_id, messages, max_tokens, bypass_cache=bypass_cache)
+        else:
+            deltas = llm.stream_chat(client, model_id, messages, max_tokens, bypass_cache=bypass_cache)
+        for delta in deltas:
+            if stage_timing["first_token"] is None:
+                stage_timing["first_token"] = round(time.perf_counter() - chain_started, 3)
+            parts.append(delta)
+            yield stage, delta
+        stage_timing["end"] = round(time.perf_counter() - chain_started, 3)
+        if timings is not None:
+            timings[stage] = stage_timing
+        stage_input = "".join(parts)
+
+
+# Function to handle advanced steps: prompt improvement, response, review, and analysis
+# on_delta(stage, delta), if given, sees the output as it streams in.
+def advanced_steps(client, query, model_id, timings=None, bypass_cache=False, on_delta=None, route=None):
+    outputs = {stage: "" for stage in ADVANCED_STAGES}
+    for stage, delta in iter_advanced_steps(client, query, model_id, timings, bypass_cache, route):
+        outputs[stage] += delta
+        if on_delta:
+            on_delta(stage, delta)
+    return tuple(outputs[stage] for stage in ADVANCED_STAGES)
+
+
+# Answer a query with any of the REASONING_TYPES and return (summary, details).
+# context should already be cut down to fit (see ChunkIndex.select); Advance Steps and
+# Enhanced System Prompt answer the query on its own. history is the conversation so far, as
+# messages; the advanced steps chain sees it as a transcript ahead of the query it improves.
+# route (router.RoutePolicy) lets the advanced steps stages run on other models.
+def run_query(client, query, model_id, system_prompt, context="", reasoning_type="Single-path", selected_task=None, bypass_cache=False, timings=None, on_delta=None,
+              history=None, route=None):
+    with tracing.span("reasoning.run_query", reasoning_type=reasoning_type, model=model_id, bypass_cache=bypass_cache, history_messages=len(history or ())):
+        if reasoning_type == "Advance Steps":
+            if history:
+                query = f"Conversation so far:\n{transcript(history)}\n\nNew request: {query}"
+            improved_prompt, generated_response, review_feedback, analysis_summary = advanced_steps(client, query, model_id, timings, bypass_cache, on_delta, route)
+            return analysis_summary, f"Improved Prompt:\n{improved_prompt}\n\nGenerated Response:\n{generated_response}\n\nReview Feedback:\n{review_feedback}"
+        if reasoning_type == "Enhanced System Prompt":
+            generated_response = enhanced_prompt_response(client, query, model_id, bypass_cache=bypass_cache, history=history)
+            return generated_response, generated_response
+        return search_and_summarize(client, query, model_id, system_prompt, context, reasoning_type, selected_task, bypass_cache=bypass_cache, history=history)
+
+
+# One-line view of iter_advanced_steps timings for display
+def format_stage_timings(timings):
+    stages = ", ".join(
+        f"{stage} {timing['end'] - timing['start']:.2f}s (first token {timing['first_token'] - timing['start']:.2f}s)"
+        if timing["first_token"] is not None else f"{stage} {timing['end'] - timing['start']:.2f}s"
+        for stage, timing in timings.items()
+    )
+    first_token = next((timing["first_token"] for timing in timings.values() if timing["first_token"] is not None), None)
+    total = max((timing["end"] for timing in timings.values()), default=0.0)
+    return f"First token after {first_token:.2f}s, done in {total:.2f}s. {stages}" if first_token is not None else f"Done in {total:.2f}s. {stages}"
@@ -0,0 +1,172 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from reasoning import run_query, search_and_summarize
+from retrieval import ChunkIndex, context_token_budget
+from tokens import CHARS_PER_TOKEN, context_window, count_tokens
+
+# Parallel requests in flight while summarizing chunks, and the request rate they share
+REPORT_MAX_WORKERS = 4
+REPORT_REQUESTS_PER_SECOND = 2.0
+# Reply size for chunk summaries and for the final report
+MAP_MAX_TOKENS = 500
+REDUCE_MAX_TOKENS = 1000
+# Largest document chunk summarized per request when a report is built map-reduce style
+REPORT_CHUNK_TOKENS = 6000
+
+
+# Spaces calls out evenly so a burst of workers never exceeds requests_per_second
+class RateLimiter:
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Chunk size for map-reduce reports: as large as the model window allows, up to REPORT_CHUNK_TOKENS
+def report_chunk_tokens(model_id, reserved_tokens=2000):
+    return max(1000, min(REPORT_CHUNK_TOKENS, context_window(model_id) - reserved_tokens))
+
+
+# Split text into consecutive pieces of roughly chunk_tokens tokens, breaking at whitespace
+def split_for_window(text, chunk_tokens):
+    # Dense scripts such as CJK hold far fewer characters per token than English
+    tokens = count_tokens(text)
+    chars_per_token = min(CHARS_PER_TOKEN, len(text) / tokens) if tokens else CHARS_PER_TOKEN
+    chunk_chars = max(1, int(chunk_tokens * chars_per_token))
+    pieces = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + chunk_chars)
+        if end < len(text):
+            cut = max(text.rfind("\n", start, end), text.rfind(" ", start, end))
+            if cut > start:
+                end = cut
+        if text[start:end].strip():
+            pieces.append(text[start:end])
+        start = end
+    return pieces
+
+
+# Group partial summaries so each group fits in one request (at least two per group, so every level shrinks)
+def _group_partials(partials, chunk_tokens):
+    groups = [[]]
+    used = 0
+    for partial in partials:
+        tokens = count_tokens(partial)
+        if len(groups[-1]) >= 2 and used + tokens > chunk_tokens:
+            groups.append([])
+            used = 0
+        groups[-1].append(partial)
+        used += tokens
+    return groups
+
+
+# Run one stage's calls on the worker pool and record its wall time and token usage
+def _run_stage(name, calls, max_workers, limiter, stats):
+    started = time.perf_counter()
+    usages = [{} for _ in calls]
+
+    def run(i):
+        limiter.acquire()
+        return calls[i](usages[i])
+
+    # Each call runs in a copy of this context so its spans nest under the report's
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, run, i) for i in range(len(calls))]
+        results = [future.result() for future in futures]
+    stats["stages"].append({
+        "stage": name,
+        "calls": len(calls),
+        "seconds": round(time.perf_counter() - started, 3),
+        "prompt_tokens": sum(usage.get("prompt_tokens", 0) for usage in usages),
+        "completion_tokens": sum(usage.get("completion_tokens", 0) for usage in usages),
+    })
+    return results
+
+
+# Map-reduce report over a document of any length: summarize window-sized chunks concurrently,
+# then merge the partial summaries level by level until one report remains.
+# Returns (summary, details, stats) where stats holds the wall time and per-stage token counts.
+def map_reduce_report(client, text, file_name, model_id, system_prompt, chunk_tokens, reasoning_type="Single-path", selected_task=None,
+                      max_workers=REPORT_MAX_WORKERS, requests_per_second=REPORT_REQUESTS_PER_SECOND):
+    started = time.perf_counter()
+    limiter = RateLimiter(requests_per_second)
+    stats = {"chunks": 0, "stages": []}
+    chunks = split_for_window(text, chunk_tokens) or [text]
+    stats["chunks"] = len(chunks)
+
+    def summarize_chunk(i, chunk):
+        def call(usage):
+            summary, details = search_and_summarize(
+                client, f"Summarize part {i + 1} of {len(chunks)} of the file {file_name} for a detailed report. Keep every key fact, figure and name.",
+                model_id, system_prompt, chunk, reasoning_type, selected_task, max_tokens=MAP_MAX_TOKENS, usage=usage)
+            return f"{summary}\n\n{details}"
+        return call
+
+    def merge_partials(group, final):
+        def call(usage):
+            query = (f"Generate a detailed report for the file: {file_name}" if final
+                     else f"Merge these partial summaries of the file {file_name} into one summary. Keep every key fact, figure and name.")
+            context = "\n\n---\n\n".join(group)
+            return search_and_summarize(client, query, model_id, system_prompt, context, reasoning_type, selected_task,
+                                        max_tokens=REDUCE_MAX_TOKENS if final else MAP_MAX_TOKENS, usage=usage)
+        return call
+
+    if len(chunks) == 1:
+        summary, details = _run_stage("report", [merge_partials(chunks, True)], 1, limiter, stats)[0]
+    else:
+        partials = _run_stage("map", [summarize_chunk(i, chunk) for i, chunk in enumerate(chunks)], max_workers, limiter, stats)
+        level = 1
+        while True:
+            groups = _group_partials(partials, chunk_tokens)
+            if len(groups) == 1:
+                summary, details = _run_stage("reduce final", [merge_partials(groups[0], True)], 1, limiter, stats)[0]
+                break
+            merged = _run_stage(f"reduce {level}", [merge_partials(group, False) for group in groups], max_workers, limiter, stats)
+            partials = [f"{summary}\n\n{details}" for summary, details in merged]
+            level += 1
+
+    stats["wall_time"] = round(time.perf_counter() - started, 3)
+    stats["prompt_tokens"] = sum(stage["prompt_tokens"] for stage in stats["stages"])
+    stats["completion_tokens"] = sum(stage["completion_tokens"] for stage in stats["stages"])
+    return summary, details, stats
+
+
+# Report on a whole document, for the Generate Report button and batch report jobs alike.
+# Advance Steps and Enhanced System Prompt answer the document itself as their prompt, so they get chunks
+# spread evenly over it (from `index` when the caller already has the document's ChunkIndex); timings,
+# on_delta and route go to their run_query call. The other types make one request when the document
+# fits the context budget, map-reduce otherwise.
+# Returns (summary, details, stats); stats is None unless the report was built map-reduce style.
+def generate_report(client, text, file_name, model_id, system_prompt, reasoning_type="Single-path", selected_task=None, text_tokens=None,
+                    index=None, timings=None, on_delta=None, route=None):
+    with tracing.span("report.generate", model=model_id, reasoning_type=reasoning_type) as span:
+        if reasoning_type in ("Advance Steps", "Enhanced System Prompt"):
+            excerpt = (index or ChunkIndex(text)).select("", context_token_budget(model_id), text)
+            summary, details = run_query(client, excerpt, model_id, system_prompt, "", reasoning_type, selected_task,
+                                         timings=timings, on_delta=on_delta, route=route)
+            return summary, details, None
+        if (text_tokens if text_tokens is not None else count_tokens(text)) <= context_token_budget(model_id):
+            summary, details = search_and_summarize(client, f"Generate a detailed report for the file: {file_name}", model_id, system_prompt, text, reasoning_type, selected_task)
+            return summary, details, None
+        summary, details, stats = map_reduce_report(client, text, file_name, model_id, system_prompt, report_chunk_tokens(model_id), reasoning_type, selected_task)
+        span.set(chunks=stats["chunks"])
+        return summary, details, stats
+
+
+# One-line summary of map_reduce_report stats for display
+def format_report_stats(stats):
+    stages = ", ".join(f"{stage['stage']}: {stage['calls']} calls, {stage['seconds']}s, {stage['prompt_tokens']}+{stage['completion_tokens']} tokens" for stage in stats["stages"])
+    return f"{stats['chunks']} chunks in {stats['wall_time']}s ({stats['prompt_tokens']} prompt + {stats['completion_tokens']} completion tokens). {stages}"
@@ -0,0 +1,111 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+from tokens import context_window, count_tokens
+
+# Words per chunk and words shared between neighbouring chunks
+CHUNK_WORDS = 200
+CHUNK_OVERLAP_WORDS = 40
+# Most file context sent with one request; larger files are cut down to their best-matching chunks
+CONTEXT_TOKEN_BUDGET = 4000
+
+_WORD_RE = re.compile(r"\S+")
+_TERM_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _TERM_RE.findall(text.lower())
+
+
+# Tokens of file context that fit alongside the prompt scaffolding and the reply for this model
+def context_token_budget(model_id, reserved_tokens=2000):
+    return max(500, min(CONTEXT_TOKEN_BUDGET, context_window(model_id) - reserved_tokens))
+
+
+# Split text into overlapping windows of words, returned as (start, end) character offsets
+def chunk_spans(text, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS):
+    words = [match.span() for match in _WORD_RE.finditer(text)]
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap_words)
+    spans = []
+    for first in range(0, len(words), step):
+        last = min(first + chunk_words, len(words)) - 1
+        spans.append((words[first][0], words[last][1]))
+        if last == len(words) - 1:
+            break
+    return spans
+
+
+# BM25 index over the chunks of one document, used to send only the relevant parts as context.
+# The index keeps chunk offsets rather than the text, so it costs no more than its postings wherever it is cached.
+class ChunkIndex:
+    def __init__(self, text, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS, k1=1.5, b=0.75):
+        self.spans = chunk_spans(text, chunk_words, overlap_words)
+        self.chunk_tokens = np.array([count_tokens(text[start:end]) for start, end in self.spans], dtype=np.int64)
+        self.total_tokens = count_tokens(text)
+
+        chunk_terms = [Counter(tokenize(text[start:end])) for start, end in self.spans]
+        lengths = np.array([sum(counts.values()) for counts in chunk_terms], dtype=np.float32)
+        avg_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+        postings = {}
+        for chunk_id, counts in enumerate(chunk_terms):
+            for term, count in counts.items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(chunk_id)
+                tfs.append(count)
+
+        # Store each term's final BM25 contribution per chunk so scoring a query is a scatter-add
+        chunk_count = len(self.spans)
+        self.postings = {}
+        for term, (ids, tfs) in postings.items():
+            ids = np.array(ids, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = math.log(1.0 + (chunk_count - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = k1 * (1.0 - b + b * lengths[ids] / avg_length)
+            self.postings[term] = (ids, idf * tfs * (k1 + 1.0) / (tfs + norm))
+
+    def score(self, query):
+        scores = np.zeros(len(self.spans), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                ids, weights = self.postings[term]
+                scores[ids] += weights
+        return scores
+
+    # Return the best-scoring chunks of text (the document this index was built from) that fit in
+    # token_budget, in document order. Without a usable query the chunks are sampled evenly so the whole
+    # document is covered.
+    def select(self, query, token_budget, text):
+        if self.total_tokens <= token_budget or not self.spans:
+            return text
+        scores = self.score(query)
+        if scores.any():
+            order = np.argsort(-scores, kind="stable")
+        else:
+            sample_size = max(1, int(token_budget // max(1, self.chunk_tokens.mean())))
+            sampled = np.unique(np.linspace(0, len(self.spans) - 1, sample_size).round().astype(np.int64))
+            order = np.concatenate([sampled, np.setdiff1d(np.arange(len(self.spans)), sampled)])
+
+        selected = []
+        used = 0
+        for chunk_id in order:
+            if scores.any() and scores[chunk_id] <= 0:
+                break
+            if used + self.chunk_tokens[chunk_id] > token_budget:
+                continue
+            selected.append(int(chunk_id))
+            used += int(self.chunk_tokens[chunk_id])
+
+        # Merge overlapping neighbours back into contiguous passages
+        passages = []
+        for chunk_id in sorted(selected):
+            start, end = self.spans[chunk_id]
+            if passages and start <= passages[-1][1]:
+                passages[-1][1] = max(passages[-1][1], end)
+            else:
+                passages.append([start, end])
+        return "\n...\n".join(text[start:end] for start, end in passages)
@@ -0,0 +1,202 @@
+import contextvars
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+import llm
+from groq_client import RequestCancelled
+from models import MODEL_QUALITY, MODEL_SPEED_PRIORS
+from tokens import SAFETY_MARGIN, context_window, count_message_tokens, count_tokens
+
+# Per-stage model routing. Each pipeline stage asks the router for a model; the router keeps the models
+# whose context window fits the prompt and whose quality the stage needs under the user's preference,
+# and picks the one with the lowest predicted latency from rolling measurements of every model call.
+# With speculative routing, a stage routed to a smaller model is raced against the selected model and
+# the slower stream is closed. Every decision is kept (and optionally appended to a JSONL file).
+
+ROUTING_PREFERENCES = ("Quality", "Balanced", "Speed")
+
+# Stages that only restate or condense text; these may go to the smallest models
+LIGHT_STAGES = {"improve", "analyze", "summarize"}
+# Quality floor for stages that produce the answer itself, under the Speed preference
+SPEED_MIN_QUALITY = 2
+
+# Weight of the newest observation in the rolling averages
+EWMA_ALPHA = 0.2
+DEFAULT_SPEED_PRIOR = (0.3, 300.0)
+
+
+# Rolling time to first token and output throughput of one model
+class ModelStats:
+    def __init__(self, first_token, tokens_per_second):
+        self.first_token = first_token
+        self.tokens_per_second = tokens_per_second
+        self.calls = 0
+
+    def observe(self, seconds, first_token, completion_tokens):
+        self.calls += 1
+        if first_token is None:
+            # Non-streamed: attribute the prior share of the time to the first token
+            first_token = min(seconds, self.first_token)
+        self.first_token += EWMA_ALPHA * (first_token - self.first_token)
+        generating = seconds - first_token
+        if completion_tokens and generating > 0:
+            self.tokens_per_second += EWMA_ALPHA * (completion_tokens / generating - self.tokens_per_second)
+
+    def predict(self, completion_tokens):
+        return self.first_token + completion_tokens / max(self.tokens_per_second, 1e-6)
+
+
+class ModelRouter:
+    def __init__(self, models=MODEL_QUALITY, log_path=None, max_decisions=500):
+        self.models = models
+        self.log_path = log_path
+        self.decisions = deque(maxlen=max_decisions)
+        self._stats = {model_id: ModelStats(*MODEL_SPEED_PRIORS.get(model_id, DEFAULT_SPEED_PRIOR)) for model_id in models}
+        self._lock = threading.Lock()
+
+    # Feed for llm.set_call_observer
+    def observe(self, model_id, seconds, first_token, completion_tokens):
+        with self._lock:
+            stats = self._stats.get(model_id)
+            if stats is None:
+                stats = self._stats[model_id] = ModelStats(*DEFAULT_SPEED_PRIOR)
+            stats.observe(seconds, first_token, completion_tokens)
+
+    def predict(self, model_id, completion_tokens):
+        with self._lock:
+            stats = self._stats.get(model_id)
+            return stats.predict(completion_tokens) if stats else None
+
+    def _min_quality(self, stage, default_model, preference):
+        default_quality = self.models.get(default_model, max(self.models.values()))
+        if preference == "Quality":
+            return default_quality
+        if stage in LIGHT_STAGES:
+            return min(self.models.values())
+        return default_quality if preference == "Balanced" else min(default_quality, SPEED_MIN_QUALITY)
+
+    # Model for one call of `stage`: the fastest predicted model that fits the prompt and meets the stage's
+    # quality floor, staying on default_model unless another is strictly faster. Under the Quality
+    # preference default_model is kept whenever the prompt fits it.
+    def choose(self, stage, default_model, prompt_tokens, max_tokens, preference="Balanced"):
+        def fits(model_id):
+            return prompt_tokens + max_tokens <= context_window(model_id) * (1 - SAFETY_MARGIN)
+
+        if preference == "Quality" and fits(default_model):
+            return default_model
+        min_quality = self._min_quality(stage, default_model, preference)
+        best, best_seconds = None, None
+        for model_id, quality in self.models.items():
+            if quality < min_quality or not fits(model_id):
+                continue
+            seconds = self.predict(model_id, max_tokens)
+            if best is None or seconds < best_seconds or (seconds == best_seconds and model_id == default_model):
+                best, best_seconds = model_id, seconds
+        return best or default_model
+
+    def record(self, decision):
+        with self._lock:
+            self.decisions.append(decision)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(decision) + "\n")
+
+    # Totals over the kept decisions; saved_seconds compares each routed call with the selected model's prediction.
+    # Races are left out of saved_seconds: both models ran, and the loser's time shows up only in the router's stats.
+    def summary(self):
+        with self._lock:
+            decisions = list(self.decisions)
+        routed = [decision for decision in decisions if decision["model"] != decision["default_model"] and not decision["speculative"]]
+        return {"decisions": len(decisions), "routed": len(routed),
+                "races": sum(1 for decision in decisions if decision["speculative"]),
+                "saved_seconds": round(sum(decision["default_predicted_seconds"] - decision["seconds"] for decision in routed), 3)}
+
+    def policy(self, preference="Balanced", speculative=False):
+        return RoutePolicy(self, preference, speculative)
+
+
+# A router bound to one request's preference; stages call chat() / stream_chat() with their stage name
+class RoutePolicy:
+    def __init__(self, router, preference, speculative):
+        self.router = router
+        self.preference = preference
+        self.speculative = speculative
+
+    def _decide(self, stage, default_model, messages, max_tokens):
+        prompt_tokens = count_message_tokens(messages)
+        model_id = self.router.choose(stage, default_model, prompt_tokens, max_tokens, self.preference)
+        return {
+            "time": time.time(), "stage": stage, "preference": self.preference, "default_model": default_model, "model": model_id,
+            "prompt_tokens": prompt_tokens, "max_tokens": max_tokens,
+            "predicted_seconds": round(self.router.predict(model_id, max_tokens) or 0.0, 3),
+            "default_predicted_seconds": round(self.router.predict(default_model, max_tokens) or 0.0, 3),
+            "speculative": self.speculative and model_id != default_model, "winner": model_id,
+        }
+
+    def chat(self, client, stage, default_model, messages, max_tokens, bypass_cache=False, usage=None):
+        decision = self._decide(stage, default_model, messages, max_tokens)
+        started = time.perf_counter()
+        if decision["speculative"]:
+            decision["winner"], response = race(client, (decision["model"], default_model), messages, max_tokens, bypass_cache, usage)
+        else:
+            response = llm.chat(client, decision["model"], messages, max_tokens, bypass_cache=bypass_cache, usage=usage)
+        decision["seconds"] = round(time.perf_counter() - started, 3)
+        self.router.record(decision)
+        return response
+
+    # Deltas like llm.stream_chat; a race yields the winner's text in one piece once it has finished
+    def stream_chat(self, client, stage, default_model, messages, max_tokens, bypass_cache=False):
+        decision = self._decide(stage, default_model, messages, max_tokens)
+        started = time.perf_counter()
+        if decision["speculative"]:
+            decision["winner"], response = race(client, (decision["model"], default_model), messages, max_tokens, bypass_cache)
+            yield response
+        else:
+            yield from llm.stream_chat(client, decision["model"], messages, max_tokens, bypass_cache=bypass_cache)
+        decision["seconds"] = round(time.perf_counter() - started, 3)
+        self.router.record(decision)
+
+
+# Stream the same request from several models at once and return (model_id, text) of the first to finish.
+# The others stop at their next chunk and close their streams, which releases the connection (and, once
+# they have produced a token, reports their partial timing to the call observer).
+# Streams carry no usage, so `usage` gets local estimates: the prompt once per racer, and the winner's reply.
+def race(client, model_ids, messages, max_tokens, bypass_cache=False, usage=None):
+    done = threading.Event()
+    results = queue.Queue()
+
+    def run(model_id):
+        # A racer still queued for a rate-limit or concurrency slot when the race ends never sends its request
+        stream = llm.stream_chat(client, model_id, messages, max_tokens, bypass_cache=bypass_cache, cancelled=done.is_set)
+        parts = []
+        try:
+            if done.is_set():
+                return
+            for delta in stream:
+                if done.is_set():
+                    return
+                parts.append(delta)
+            results.put((model_id, "".join(parts), None))
+        except RequestCancelled:
+            pass
+        except Exception as e:
+            results.put((model_id, None, e))
+        finally:
+            stream.close()
+
+    for model_id in model_ids:
+        # Each racer runs in a copy of this context so its spans nest under the caller's
+        threading.Thread(target=contextvars.copy_context().run, args=(run, model_id), daemon=True).start()
+    error = None
+    for _ in model_ids:
+        model_id, text, error = results.get()
+        if error is None:
+            done.set()
+            if usage is not None:
+                usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + count_message_tokens(messages) * len(model_ids)
+                usage["completion_tokens"] = usage.get("completion_tokens", 0) + count_tokens(text)
+            return model_id, text
+    raise error
@@ -0,0 +1,96 @@
+import re
+import threading
+from collections import OrderedDict
+
+from models import DEFAULT_CONTEXT_WINDOW, MODEL_CONTEXT_WINDOWS
+
+# Tokens the chat format adds per message, and headroom kept free because counts are estimates
+MESSAGE_OVERHEAD_TOKENS = 4
+SAFETY_MARGIN = 0.05
+# Smallest reply worth asking for when the prompt nearly fills the window
+MIN_COMPLETION_TOKENS = 256
+# Average characters per token for English text, for splitting text without counting it
+CHARS_PER_TOKEN = 4
+
+# ASCII words, single non-ASCII word characters and single punctuation marks. BPE vocabularies split long
+# ASCII words into pieces of about five characters, but spend about a token on each CJK (or other non-ASCII) character.
+_PIECE_RE = re.compile(r"[0-9A-Za-z_]+|\w|[^\w\s]")
+
+
+def context_window(model_id):
+    return MODEL_CONTEXT_WINDOWS.get(model_id, DEFAULT_CONTEXT_WINDOW)
+
+
+# Fast local token estimate, slightly on the high side so budgets err towards fitting
+def count_tokens(text):
+    if not text:
+        return 0
+    return sum((len(piece) + 4) // 5 for piece in _PIECE_RE.findall(text))
+
+
+def count_message_tokens(messages):
+    return sum(count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+_document_counts = OrderedDict()
+_document_counts_lock = threading.Lock()
+
+
+# count_tokens memoized by document hash, so a stored document is counted once per process
+def count_document_tokens(doc_hash, text, max_entries=256):
+    with _document_counts_lock:
+        if doc_hash in _document_counts:
+            _document_counts.move_to_end(doc_hash)
+            return _document_counts[doc_hash]
+    count = count_tokens(text)
+    with _document_counts_lock:
+        _document_counts[doc_hash] = count
+        while len(_document_counts) > max_entries:
+            _document_counts.popitem(last=False)
+    return count
+
+
+# Deterministically shrink text to at most max_tokens: collapse runs of whitespace first,
+# then keep the head and the tail (where documents state their subject and conclusions).
+def fit_text(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    text = re.sub(r"[ \t]+", " ", re.sub(r"\n\s*\n+", "\n\n", text))
+    if count_tokens(text) <= max_tokens:
+        return text
+    marker = "\n[...]\n"
+    budget = max_tokens - count_tokens(marker)
+    if budget < 0:
+        # Too small for even the marker
+        return ""
+    pieces = list(_PIECE_RE.finditer(text))
+    head_budget = budget * 2 // 3
+    head_end, used = 0, 0
+    for piece in pieces:
+        cost = (len(piece.group()) + 4) // 5
+        if used + cost > head_budget:
+            break
+        used += cost
+        head_end = piece.end()
+    tail_start, used_tail = len(text), 0
+    for piece in reversed(pieces):
+        cost = (len(piece.group()) + 4) // 5
+        if used + used_tail + cost > budget or piece.start() < head_end:
+            break
+        used_tail += cost
+        tail_start = piece.start()
+    return text[:head_end] + marker + text[tail_start:]
+
+
+# Room left for the reply: the requested max_tokens, capped by what the prompt leaves of the window
+def completion_budget(model_id, prompt_tokens, max_tokens):
+    window = int(context_window(model_id) * (1 - SAFETY_MARGIN))
+    return max(MIN_COMPLETION_TOKENS, min(max_tokens, window - prompt_tokens))
+
+
+# Tokens available for one variable section (file context, a prior stage's output) once the fixed
+# parts of the prompt and a minimum reply are accounted for
+def section_budget(model_id, fixed_tokens, max_tokens):
+    window = int(context_window(model_id) * (1 - SAFETY_MARGIN))
+    reply = min(max_tokens, max(MIN_COMPLETION_TOKENS, window // 4))
+    return max(0, window - fixed_tokens - reply)
@@ -0,0 +1,297 @@
+import contextvars
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+
+# Lightweight request tracing. Code on the hot path opens spans with span() / start_span(); while no
+# tracer is installed these return a shared no-op span, so instrumented code costs one global lookup.
+#
+# A Tracer keeps recent finished spans for the sidebar panel, latency histograms per model and per
+# reasoning type, and can append every span to a file as OTLP/JSON (one ExportTraceServiceRequest per
+# line, the format of the OpenTelemetry collector's file exporter and otlpjsonfile receiver).
+
+_tracer = None
+_current_span = contextvars.ContextVar("gsearch_current_span", default=None)
+
+# Spans whose durations feed a histogram, and the attribute that groups them
+HISTOGRAM_GROUPS = {
+    "llm.chat": "model",
+    "reasoning.run_query": "reasoning_type",
+    "report.generate": "model",
+    "extraction.extract": "format",
+    "streamlit.rerun": None,
+    "streamlit.fragment": "fragment",
+}
+# Numeric llm.chat attributes that get a histogram of their own, per model
+LLM_TIMING_ATTRIBUTES = ("time_to_first_token", "queue_wait")
+
+
+# Install the process-wide tracer (None turns tracing off)
+def set_tracer(tracer):
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+class _NoopSpan:
+    recording = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        return self
+
+    def add(self, **amounts):
+        return self
+
+    def end(self, error=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    recording = True
+
+    def __init__(self, tracer, name, parent, attributes, activate):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else random.getrandbits(128)
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self._token = _current_span.set(self) if activate else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(error=f"{exc_type.__name__}: {exc}" if exc_type else None)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    # Accumulate numeric attributes, e.g. queue wait summed over retries
+    def add(self, **amounts):
+        for name, amount in amounts.items():
+            self.attributes[name] = self.attributes.get(name, 0) + amount
+        return self
+
+    def end(self, error=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        self.error = error
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # Ended from another context (e.g. a generator closed elsewhere); that context keeps its own value
+                pass
+        self.tracer.record(self)
+
+    @property
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+# Open a span as a context manager; it becomes the parent of spans opened inside it
+def span(name, **attributes):
+    tracer = _tracer
+    if tracer is None:
+        return NOOP_SPAN
+    return Span(tracer, name, _current_span.get(), attributes, activate=True)
+
+
+# Open a span that is ended explicitly with span.end(). With activate=False it does not become the
+# current span, which is what a generator needs since its body runs in its caller's context.
+# root=True starts a new trace regardless of the current span.
+def start_span(name, activate=True, root=False, **attributes):
+    tracer = _tracer
+    if tracer is None:
+        return NOOP_SPAN
+    return Span(tracer, name, None if root else _current_span.get(), attributes, activate)
+
+
+def current_span():
+    current = _current_span.get()
+    return current if current is not None and _tracer is not None else NOOP_SPAN
+
+
+# Make `span` the current span for the duration of the block
+class use_span:
+    def __init__(self, span):
+        self.span = span
+        self._token = None
+
+    def __enter__(self):
+        if self.span.recording:
+            self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, *exc_info):
+        if self._token is not None:
+            _current_span.reset(self._token)
+        return False
+
+
+# Log-bucketed latency histogram: bounded memory, percentiles accurate to one bucket (about 10%)
+class Histogram:
+    MIN_SECONDS = 1e-4
+    GROWTH = 1.1
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = 0 if seconds <= self.MIN_SECONDS else int(math.log(seconds / self.MIN_SECONDS, self.GROWTH)) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    # Upper bound of the bucket holding the q-th quantile, capped at the largest value seen
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.max, self.MIN_SECONDS * self.GROWTH ** index)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "mean": self.total / self.count if self.count else None,
+                "p50": self.percentile(0.5), "p95": self.percentile(0.95), "p99": self.percentile(0.99), "max": self.max}
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_span(span):
+    record = {
+        "traceId": f"{span.trace_id:032x}",
+        "spanId": f"{span.span_id:016x}",
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items() if value is not None],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id is not None:
+        record["parentSpanId"] = f"{span.parent_id:016x}"
+    return record
+
+
+# Collects finished spans; thread-safe, shared by every session
+class Tracer:
+    def __init__(self, export_path=None, max_spans=2000, service_name="gsearch"):
+        self.export_path = export_path
+        self.service_name = service_name
+        self.spans = deque(maxlen=max_spans)
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._export_file = open(export_path, "a", encoding="utf-8") if export_path else None
+
+    def _observe(self, metric, group, seconds):
+        key = (metric, group)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+            if span.name in HISTOGRAM_GROUPS:
+                group_attribute = HISTOGRAM_GROUPS[span.name]
+                group = span.attributes.get(group_attribute) if group_attribute else None
+                self._observe(span.name, group, span.duration)
+                if span.name == "llm.chat":
+                    for name in LLM_TIMING_ATTRIBUTES:
+                        if span.attributes.get(name) is not None:
+                            self._observe(f"llm.{name}", group, span.attributes[name])
+            if self._export_file is not None:
+                self._export_file.write(json.dumps({"resourceSpans": [{
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                    "scopeSpans": [{"scope": {"name": "gsearch.tracing"}, "spans": [otlp_span(span)]}],
+                }]}) + "\n")
+                self._export_file.flush()
+
+    # Most recent traces whose root span matches, newest first, as (root, [(depth, span), ...])
+    def recent_traces(self, limit=5, root_name=None, **root_attributes):
+        with self._lock:
+            spans = list(self.spans)
+        roots = [span for span in reversed(spans) if span.parent_id is None and (root_name is None or span.name == root_name)
+                 and all(span.attributes.get(key) == value for key, value in root_attributes.items())][:limit]
+        traces = []
+        for root in roots:
+            children = {}
+            for span in spans:
+                if span.trace_id == root.trace_id and span.parent_id is not None:
+                    children.setdefault(span.parent_id, []).append(span)
+            ordered = []
+
+            def walk(node, depth):
+                ordered.append((depth, node))
+                for child in sorted(children.get(node.span_id, []), key=lambda child: child.start_ns):
+                    walk(child, depth + 1)
+
+            walk(root, 0)
+            traces.append((root, ordered))
+        return traces
+
+    # [{"metric", "group", "count", "p50", "p95", "p99", "max"}] with times in milliseconds
+    def histogram_rows(self):
+        with self._lock:
+            items = sorted(self.histograms.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            summaries = [(metric, group, histogram.summary()) for (metric, group), histogram in items]
+        return [{"metric": metric, "group": group or "", "count": summary["count"],
+                 **{name: round(summary[name] * 1000, 1) for name in ("p50", "p95", "p99", "max")}}
+                for metric, group, summary in summaries]
+
+    def close(self):
+        with self._lock:
+            if self._export_file is not None:
+                self._export_file.close()
+                self._export_file = None
+
+
+# One line per span of a trace: indented name, duration in ms and its attributes
+def format_trace(ordered):
+    lines = []
+    for depth, span in ordered:
+        attributes = ", ".join(f"{key}={round(value, 3) if isinstance(value, float) else value}"
+                               for key, value in span.attributes.items() if value is not None and key != "session")
+        status = " ERROR" if span.error else ""
+        lines.append(f"{'  ' * depth}{span.name} {span.duration * 1000:.1f}ms{status}" + (f" [{attributes}]" if attributes else ""))
+    return "\n".join(lines)